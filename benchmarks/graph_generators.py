@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = graph_generators.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Seeded synthetic graphs for the benchmarks, written as the usual 3 column edge CSV
+(node1, node2, weight).  Every generator takes a target number of edges and a seed and
+gives back (src, dst, weight) arrays -- the same seed always gives the same graph.
+
+    plantedPartition: equal sized groups, a fraction mixing of the edges goes across groups
+    lfrLike:          power law degrees and power law community sizes (in the spirit of
+                      Lancichinetti, Fortunato, Radicchi Phys Rev E 78, 046110 (2008))
+    forest:           lots of disconnected planted partition pieces of power law sizes
+
+"""
+#================================
+#Imports
+import numpy as np
+
+#================================
+#Functions
+def plantedPartition(nEdges,seed=0,avgDegree=10,groupSize=50,mixing=0.1,weighted=True):
+    '''equal sized groups of groupSize nodes, a fraction mixing of the edges lands between groups'''
+    random = np.random.RandomState(seed)
+    nNodes = max(2,2*nEdges//avgDegree)
+    nGroups = max(1,nNodes//groupSize)
+    src = random.randint(0,nNodes,nEdges)
+    group = src % nGroups
+    across = random.rand(nEdges) < mixing
+    #inside: another node of the same group (node ids are group + k*nGroups)
+    groupCount = np.maximum(1,(nNodes-group+nGroups-1)//nGroups)
+    dst = group + nGroups*np.floor(random.rand(nEdges)*groupCount).astype(np.int64)
+    dst[across] = random.randint(0,nNodes,across.sum())
+    return dropSelfLoops(src,dst,edgeWeights(random,nEdges,weighted))
+
+def powerLaw(random,n,exponent,minValue,maxValue):
+    '''n integers drawn from p(x) ~ x^-exponent on [minValue, maxValue]'''
+    u = random.rand(n)
+    lo = float(minValue)**(1-exponent)
+    hi = float(maxValue)**(1-exponent)
+    return np.floor((lo + u*(hi-lo))**(1.0/(1-exponent))).astype(np.int64)
+
+def lfrLike(nEdges,seed=0,avgDegree=10,degreeExponent=2.5,communityExponent=1.5,mixing=0.2,weighted=True):
+    '''power law degrees and community sizes, a fraction mixing of every node's stubs is wired across communities'''
+    random = np.random.RandomState(seed)
+    nNodes = max(2,2*nEdges//avgDegree)
+    degrees = powerLaw(random,nNodes,degreeExponent,max(1,avgDegree//3),max(2,int(nNodes**0.5)))
+    #rescale so the stubs add up to about 2*nEdges
+    degrees = np.maximum(1,np.round(degrees*(2.0*nEdges/degrees.sum())).astype(np.int64))
+
+    #community sizes until every node has one
+    sizes = []
+    total = 0
+    while total < nNodes:
+        size = int(powerLaw(random,1,communityExponent,10,max(11,nNodes//10))[0])
+        sizes.append(size)
+        total += size
+    community = np.repeat(np.arange(len(sizes)),sizes)[:nNodes]
+
+    stubs = np.repeat(np.arange(nNodes),degrees)
+    random.shuffle(stubs)
+    across = random.rand(len(stubs)) < mixing
+    src = []
+    dst = []
+    #inside stubs are paired up inside their own community, the rest anywhere
+    inside = stubs[~across]
+    inside = inside[np.argsort(community[inside],kind='mergesort')]
+    half = len(inside)//2
+    pairs = inside[:2*half].reshape(half,2)
+    keep = community[pairs[:,0]] == community[pairs[:,1]]
+    src.append(pairs[keep,0])
+    dst.append(pairs[keep,1])
+    outside = stubs[across]
+    half = len(outside)//2
+    src.append(outside[:half])
+    dst.append(outside[half:2*half])
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+    return dropSelfLoops(src,dst,edgeWeights(random,len(src),weighted))
+
+def forest(nEdges,seed=0,avgDegree=6,mixing=0.05,weighted=True):
+    '''disconnected planted partition pieces with power law sizes, from a couple of nodes to a few thousand'''
+    random = np.random.RandomState(seed)
+    pieces = []
+    offset = 0
+    done = 0
+    while done < nEdges:
+        pieceEdges = int(min(nEdges-done,powerLaw(random,1,2.0,1,max(2,nEdges//20))[0]))
+        src, dst, weights = plantedPartition(pieceEdges,seed=random.randint(1<<30),avgDegree=avgDegree,groupSize=20,mixing=mixing,weighted=weighted)
+        pieces.append((src+offset,dst+offset,weights))
+        offset += int(max(src.max(),dst.max())) + 1 if len(src) else 0
+        done += pieceEdges
+    return tuple(np.concatenate(column) for column in zip(*pieces))
+
+def edgeWeights(random,n,weighted):
+    if weighted:
+        return np.round(0.1 + random.rand(n),4)
+    return np.ones(n)
+
+def dropSelfLoops(src,dst,weights):
+    keep = src != dst
+    return src[keep], dst[keep], weights[keep]
+
+def writeEdgeCSV(fn,src,dst,weights,chunk=1000000):
+    '''writes the edges as node1,node2,weight lines (node names are n<id>)'''
+    outFile = open(fn,'w')
+    for start in xrange(0,len(src),chunk):
+        rows = zip(src[start:start+chunk].tolist(),dst[start:start+chunk].tolist(),weights[start:start+chunk].tolist())
+        outFile.write(''.join(["n%d,n%d,%r\n" % row for row in rows]))
+    outFile.close()
+
+GENERATORS = {"planted":plantedPartition,"lfr":lfrLike,"forest":forest}
+
+#END Functions
+#================================
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = runBenchmarks.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Runs modularity_cluster on the synthetic graphs of graph_generators and times every
+phase on its own: loadEdges (reading the CSV), setUpCommunity, findCommunities and the
+writers (printClustersJSON, printMR, printgnu with its sparse and block versions and
+saveNpz).  For every phase it records the wall time and the peak RSS so far, and for
+the run the final Q and number of clusters.
+
+Every case runs in a process of its own so the peak RSS belongs to that case only.
+The results go to a JSON file, pass an older one with --compare to see the ratios.
+
+    python runBenchmarks.py --sizes 1000,10000,100000 --output results.json
+    python runBenchmarks.py --sizes 1000,10000,100000 --output new.json --compare results.json
+
+"""
+#================================
+#Imports
+import sys
+import os
+import time
+import json
+import shutil
+import tempfile
+import platform
+import resource
+import argparse
+from multiprocessing import Process, Queue
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+
+from graph_generators import GENERATORS, writeEdgeCSV
+from edge_stream import edge_stream
+from modularity_clustering import modularity_cluster
+
+#================================
+#Functions
+def peakRSS():
+    '''peak resident set size of this process so far, in MB (ru_maxrss is KB on linux, bytes on OS X)'''
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxRSS/(1024.0*1024.0)
+    return maxRSS/1024.0
+
+def makeGraph(generator,nEdges,seed,fn):
+    '''writes the edge CSV of one generator and size'''
+    src, dst, weights = GENERATORS[generator](nEdges,seed=seed)
+    writeEdgeCSV(fn,src,dst,weights)
+
+def runCase(case,fn,workDir,gnuMaxNodes,queue):
+    '''runs the phases of one case and puts its record on the queue'''
+    record = dict(case)
+    record["phases"] = {}
+    try:
+        def phase(name,function,*args,**kwargs):
+            start = time.time()
+            result = function(*args,**kwargs)
+            record["phases"][name] = {"seconds":time.time()-start,"peakRSSMB":peakRSS()}
+            return result
+
+        graph = phase("loadEdges",edge_stream().load,fn)
+        mc = modularity_cluster(verbose=False)
+        phase("setUpCommunity",mc.setUpGraph,graph)
+        phase("findCommunities",mc.findCommunities,stopAtFirstNegativeDeltaQ=False,method=case["method"])
+        phase("printClustersJSON",mc.printClustersJSON,outputFile=os.path.join(workDir,"communities.json"))
+        phase("printMR",mc.printMR,outputFile=os.path.join(workDir,"MR_output.dat"))
+        phase("printgnuSparse",mc.printgnuSparse,filename=os.path.join(workDir,"gnuSparse.dat"))
+        phase("printgnuBlocks",mc.printgnuBlocks,filename=os.path.join(workDir,"gnuBlocks.dat"))
+        phase("saveNpz",mc.saveNpz,filename=os.path.join(workDir,"communities.npz"))
+        if mc.nNodes <= gnuMaxNodes:
+            #dense nNodes x nNodes output, only for the small graphs
+            phase("printgnu",mc.printgnu,filename=os.path.join(workDir,"gnuOut.dat"))
+
+        record["nNodes"] = mc.nNodes
+        record["nDistinctEdges"] = graph.nEdges()//2
+        record["Q"] = mc.maxQValue
+        record["nClusters"] = len(mc.maxQValueCommData)
+        record["totalSeconds"] = sum(p["seconds"] for p in record["phases"].itervalues())
+        record["peakRSSMB"] = peakRSS()
+    except:
+        record = None
+        raise
+    finally:
+        queue.put(record)
+
+def inChild(target,*args):
+    '''runs target in a fresh process, returns what it put on the queue (None if it died)'''
+    queue = Queue()
+    child = Process(target=target,args=args+(queue,))
+    child.start()
+    result = queue.get()
+    child.join()
+    if child.exitcode != 0:
+        return None
+    return result
+
+def buildGraph(generator,nEdges,seed,fn,queue):
+    try:
+        makeGraph(generator,nEdges,seed,fn)
+    finally:
+        queue.put(None)
+
+def caseKey(record):
+    return (record["generator"],record["nEdges"],record["method"],record["seed"])
+
+def compare(results,baseline):
+    '''prints new/old ratios of the times and peak RSS and the change in Q for the cases in both'''
+    old = dict((caseKey(record),record) for record in baseline["results"])
+    print "%-8s %10s %-10s %-18s %10s %10s %12s" % ("graph","edges","method","phase","time new/old","RSS new/old","Q new-old")
+    for record in results:
+        before = old.get(caseKey(record))
+        if before is None:
+            continue
+        for name,now in sorted(record["phases"].iteritems()):
+            then = before["phases"].get(name)
+            if then is None:
+                continue
+            print "%-8s %10d %-10s %-18s %10.3f %10.3f %12s" % (record["generator"],record["nEdges"],record["method"],name,
+                                                              now["seconds"]/max(then["seconds"],1e-9),
+                                                              now["peakRSSMB"]/max(then["peakRSSMB"],1e-9),
+                                                              "")
+        print "%-8s %10d %-10s %-18s %10.3f %10.3f %12.3g" % (record["generator"],record["nEdges"],record["method"],"total",
+                                                          record["totalSeconds"]/max(before["totalSeconds"],1e-9),
+                                                          record["peakRSSMB"]/max(before["peakRSSMB"],1e-9),
+                                                          record["Q"]-before["Q"])
+
+#END Functions
+#================================
+
+#================================
+#Main
+#================================
+
+def main():
+    parser = argparse.ArgumentParser(description="times modularity_cluster phase by phase on seeded synthetic graphs")
+    parser.add_argument("--sizes",default="1000,10000,100000",help="comma separated numbers of edges (1000 up to 10000000)")
+    parser.add_argument("--generators",default="planted,lfr,forest",help="comma separated, out of "+",".join(sorted(GENERATORS)))
+    parser.add_argument("--methods",default="greedy,multilevel",help="comma separated findCommunities methods")
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--gnuMaxNodes",type=int,default=1000,help="only time printgnu (dense output) up to this many nodes")
+    parser.add_argument("--output",default="results.json")
+    parser.add_argument("--compare",default=None,help="earlier results file to compare against")
+    parser.add_argument("--tmpDir",default=None,help="where the generated CSVs and outputs go")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    generators = args.generators.split(",")
+    methods = args.methods.split(",")
+    for generator in generators:
+        if generator not in GENERATORS:
+            print "unknown generator", generator
+            sys.exit(1)
+
+    workDir = tempfile.mkdtemp(prefix="modularity_bench_",dir=args.tmpDir)
+    results = []
+    try:
+        for generator in generators:
+            for nEdges in sizes:
+                fn = os.path.join(workDir,"%s_%d.csv" % (generator,nEdges))
+                inChild(buildGraph,generator,nEdges,args.seed,fn)
+                for method in methods:
+                    case = {"generator":generator,"nEdges":nEdges,"method":method,"seed":args.seed}
+                    record = inChild(runCase,case,fn,workDir,args.gnuMaxNodes)
+                    if record is None:
+                        print "%-8s %10d %-10s FAILED" % (generator,nEdges,method)
+                        continue
+                    results.append(record)
+                    print "%-8s %10d %-10s %8d nodes %10.2f s %8.1f MB  Q = %.4f (%d clusters)" % (generator,nEdges,method,record["nNodes"],
+                                                                                               record["totalSeconds"],record["peakRSSMB"],
+                                                                                               record["Q"],record["nClusters"])
+                os.remove(fn)
+    finally:
+        shutil.rmtree(workDir,ignore_errors=True)
+
+    output = {"python":platform.python_version(),"machine":platform.platform(),"date":time.strftime("%Y-%m-%d %H:%M:%S"),"results":results}
+    outFile = open(args.output,'w')
+    json.dump(output,outFile,indent=4,sort_keys=True)
+    outFile.close()
+
+    if args.compare:
+        compare(results,json.load(open(args.compare)))
+
+if __name__ == '__main__':
+    main()
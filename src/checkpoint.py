@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = checkpoint.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Periodic checkpoints of a long running clustering.
+
+A checkpoint is a plain (uncompressed) NumPy .npz of flat arrays, written to a
+temporary name and renamed over the old one, so there always is one complete
+checkpoint on disk.  Where the OS has fork the arrays are built and written by a
+forked child: the join loop only pays for the fork itself (the child gets a copy on
+write snapshot of the whole state) and goes on straight away.  A checkpoint that comes
+due while the last one is still being written is skipped.
+
+"""
+#================================
+#Imports
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+
+#================================
+#Functions
+def saveArrays(fn,arrays):
+    '''writes the dict of arrays to fn, through a temporary file so fn is never half written'''
+    tmpFN = fn + ".tmp"
+    outFile = open(tmpFN,'wb')
+    np.savez(outFile,**arrays)
+    outFile.close()
+    os.rename(tmpFN,fn)
+
+def loadArrays(fn):
+    '''reads back the dict of arrays saveArrays wrote'''
+    data = np.load(fn)
+    try:
+        return dict((name,data[name]) for name in data.files)
+    finally:
+        data.close()
+
+#================================
+#Classes
+class checkpoint_writer(object):
+    '''decides when a checkpoint is due and writes it without holding up the caller'''
+
+    def __init__(self,fn,every=None,seconds=300.0):
+        self.fn = fn                            #checkpoint file
+        self.every = every                      #write every this many steps (None: only by time)
+        self.seconds = seconds                  #write every this many seconds (None: only by steps)
+        self.lastStep = 0
+        self.lastTime = time.time()
+        self.pid = None                         #child still writing the last checkpoint
+        self.nWritten = 0                       #checkpoints started
+        self.nSkipped = 0                       #checkpoints skipped since the last one was still being written
+
+    def due(self,step):
+        '''whether a checkpoint should be written at step'''
+        if self.every is not None and step - self.lastStep >= self.every:
+            return True
+        return self.seconds is not None and time.time() - self.lastTime >= self.seconds
+
+    def write(self,step,arrays):
+        '''writes the arrays returned by calling arrays(), in a forked child if there is fork'''
+        self.lastStep = step
+        self.lastTime = time.time()
+        if self.pid is not None and not self.poll():
+            self.nSkipped += 1
+            return
+        self.nWritten += 1
+        if not hasattr(os,"fork"):
+            saveArrays(self.fn,arrays())
+            return
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                saveArrays(self.fn,arrays())
+                status = 0
+            except:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        self.pid = pid
+
+    def poll(self):
+        '''whether the child writing the last checkpoint is done (and reaps it)'''
+        pid, status = os.waitpid(self.pid,os.WNOHANG)
+        if pid == 0:
+            return False
+        self.finished(status)
+        return True
+
+    def wait(self):
+        '''waits for the last checkpoint to be on disk'''
+        if self.pid is not None:
+            pid, status = os.waitpid(self.pid,0)
+            self.finished(status)
+
+    def finished(self,status):
+        self.pid = None
+        if status != 0:
+            sys.stderr.write("writing checkpoint %s failed, the previous one (if any) is still there\n" % (self.fn,))
+
+#END Classes
+#================================
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = cluster_model.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Read-only, memory mappable copy of a finished break up for serving lookups.
+
+The model file holds the node names sorted (fixed width bytes) and the int32 community
+of every name in the same order, so a batch of names is resolved with one
+searchsorted over the mapped arrays instead of a dict lookup per name.  The arrays
+are mapped straight from the file, so any number of worker processes loading the same
+file share the pages of the OS cache and nothing gets copied.
+
+File layout: the magic bytes, an 8 byte header length, the JSON header (nNodes,
+nameWidth, Q and where the arrays start) and then the two arrays, 8 byte aligned.
+
+"""
+#================================
+#Imports
+import json
+import struct
+
+import numpy as np
+
+MAGIC = "MODCLUS1"
+
+#================================
+#Functions
+def saveModel(fn,names,clusters,Q=0.0):
+    '''writes the model file for node names and their community (int, -1 for none)'''
+    names = np.array([name.encode("utf-8") if isinstance(name,unicode) else str(name) for name in names])
+    if names.dtype.itemsize == 0:
+        names = names.astype("S1")
+    clusters = np.asarray(clusters,dtype="<i4")
+    order = np.argsort(names,kind='mergesort')
+    names = names[order]
+    clusters = clusters[order]
+    if len(names) > 1 and (names[1:] == names[:-1]).any():
+        raise ValueError("node names have to be unique")
+
+    width = names.dtype.itemsize
+    header = {"nNodes":len(names),"nameWidth":width,"Q":float(Q),"namesOffset":0,"clustersOffset":0}
+    #the offsets are in the header, so go round until its length stops moving them
+    while True:
+        text = json.dumps(header,sort_keys=True)
+        namesOffset = align(len(MAGIC) + 8 + len(text))
+        clustersOffset = align(namesOffset + width*len(names))
+        if (namesOffset,clustersOffset) == (header["namesOffset"],header["clustersOffset"]):
+            break
+        header["namesOffset"] = namesOffset
+        header["clustersOffset"] = clustersOffset
+
+    outFile = open(fn,'wb')
+    outFile.write(MAGIC)
+    outFile.write(struct.pack("<q",len(text)))
+    outFile.write(text)
+    outFile.write("\0"*(header["namesOffset"] - len(MAGIC) - 8 - len(text)))
+    names.tofile(outFile)
+    outFile.write("\0"*(header["clustersOffset"] - header["namesOffset"] - width*len(names)))
+    clusters.tofile(outFile)
+    outFile.close()
+
+def align(offset):
+    '''next multiple of 8'''
+    return (offset + 7) // 8 * 8
+
+_shared = {}
+def sharedModel(fn):
+    '''the cluster_model of fn, loaded once per process (call it in every worker, or once before forking)'''
+    model = _shared.get(fn)
+    if model is None:
+        model = _shared[fn] = cluster_model.load(fn)
+    return model
+
+#================================
+#Classes
+class cluster_model(object):
+    '''node name -> community lookups on a (memory mapped) sorted name index'''
+
+    def __init__(self,names,clusters,Q=0.0):
+        self.names = names                      #sorted node names, fixed width bytes
+        self.clusters = clusters                #community of every name (int32, -1 for none)
+        self.Q = Q                              #modularity of the break up
+
+    @classmethod
+    def load(cls,fn):
+        '''maps the model file fn read-only, nothing is read until it is looked up'''
+        inFile = open(fn,'rb')
+        try:
+            if inFile.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a model file" % (fn,))
+            length, = struct.unpack("<q",inFile.read(8))
+            header = json.loads(inFile.read(length))
+        finally:
+            inFile.close()
+        nNodes = header["nNodes"]
+        if nNodes == 0:
+            return cls(np.zeros(0,dtype="S1"),np.zeros(0,dtype="<i4"),header["Q"])
+        names = np.memmap(fn,dtype="S%d" % header["nameWidth"],mode='r',offset=header["namesOffset"],shape=(nNodes,))
+        clusters = np.memmap(fn,dtype="<i4",mode='r',offset=header["clustersOffset"],shape=(nNodes,))
+        return cls(names,clusters,header["Q"])
+
+    def __len__(self):
+        return len(self.names)
+
+    def positions(self,nodes):
+        '''where every name of nodes sits in the index, -1 if it is not there'''
+        nodes = np.asarray(nodes)
+        if nodes.dtype.kind == 'U':
+            nodes = np.char.encode(nodes,"utf-8")
+        elif nodes.dtype.kind != 'S':
+            nodes = nodes.astype(str)
+        if not len(self.names):
+            return np.zeros(nodes.shape,dtype=np.int64) - 1
+        pos = np.minimum(np.searchsorted(self.names,nodes),len(self.names)-1)
+        return np.where(self.names[pos] == nodes,pos,-1)
+
+    def clustersOf(self,nodes):
+        '''community of every name in nodes (array or list), -1 for names it does not know'''
+        pos = self.positions(nodes)
+        return np.where(pos >= 0,np.asarray(self.clusters)[np.maximum(pos,0)],-1).astype(np.int32)
+
+    def sameCluster(self,nodes1,nodes2):
+        '''for every pair nodes1[k], nodes2[k]: are both known and in the same community'''
+        clusters1 = self.clustersOf(nodes1)
+        clusters2 = self.clustersOf(nodes2)
+        return (clusters1 == clusters2) & (clusters1 >= 0)
+
+    def getMembership(self,node):
+        '''community of one node, like modularity_cluster.getMembership (KeyError if unknown)'''
+        cluster = int(self.clustersOf([node])[0])
+        if cluster < 0:
+            raise KeyError(node)
+        return cluster
+
+    def areInSameComm(self,node1,node2):
+        '''tests if two nodes are in the same community'''
+        return bool(self.sameCluster([node1],[node2])[0])
+
+#END Classes
+#================================
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = edge_stream.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Single pass, chunked reader for the 3 column edge CSV (node1, node2, weight).
+
+The file is read in large chunks of lines, every chunk is parsed in bulk (csv module
+for the split, NumPy for the weights) and its edges are folded into a buffer keyed on
+the (smaller id, larger id) pair, so duplicates are merged as they come in (the last
+row for a pair wins, like it always has).  When the buffer gets too big it is written
+to disk as a sorted run and the runs are merged range by range at the end, so the CSV
+itself never has to fit in memory -- only the de-duplicated graph does.
+
+"""
+#================================
+#Imports
+import sys
+import os
+import csv
+import shutil
+import tempfile
+from itertools import imap, izip
+from operator import methodcaller
+
+import numpy as np
+
+from graph_core import csr_graph, node_index
+
+#================================
+#Functions
+def lastPerKey(keys,weights):
+    '''sorts the pairs by key and keeps the last weight given for every key'''
+    order = np.argsort(keys,kind='mergesort') #stable, so rows keep file order within a key
+    keys = keys[order]
+    weights = weights[order]
+    if len(keys):
+        last = np.ones(len(keys),dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        keys = keys[last]
+        weights = weights[last]
+    return keys, weights
+
+#================================
+#Classes
+class edge_stream(object):
+    '''reads an edge CSV into a csr_graph in one pass, in bounded memory'''
+
+    def __init__(self, chunkBytes=32*1024*1024, maxBufferedEdges=20000000, tmpDir=None, verbose=False):
+        self.chunkBytes = chunkBytes            #roughly how much of the file is parsed at once
+        self.maxBufferedEdges = maxBufferedEdges #spill a sorted run to disk past this many buffered edges
+        self.tmpDir = tmpDir                    #where the runs go (default: system temp dir)
+        self.verbose = verbose
+        self.header = ""                        #if the CSV has a header, it will be stored here
+        self.nRows = 0                          #number of rows read
+
+        self.index = node_index()
+        self.bufferKeys = []                    #chunks of (lo << 32 | hi) keys waiting to be merged
+        self.bufferWeights = []
+        self.nBuffered = 0
+        self.runs = []                          #(keysFile, weightsFile) of the spilled sorted runs
+        self.runDir = None
+
+    def load(self,fn,ignoreHeader=False):
+        '''reads fn and returns the csr_graph for it'''
+        loadFile = open(fn,'rb')
+        try:
+            if ignoreHeader:
+                self.header = csv.reader([loadFile.readline()], skipinitialspace=True, dialect = "excel").next()
+
+            while True:
+                text = loadFile.read(self.chunkBytes)
+                if not text:
+                    break
+                text += loadFile.readline() #finish the last line of the chunk
+                self.addRows(*self.parseChunk(text))
+            keys, weights = self.mergeRuns()
+        finally:
+            loadFile.close()
+            if self.runDir is not None:
+                shutil.rmtree(self.runDir,ignore_errors=True)
+                self.runDir = None
+
+        lo = (keys >> 32).astype(np.int64)
+        hi = (keys & 0xFFFFFFFF).astype(np.int64)
+        if self.verbose:
+            print "Read", self.nRows, "rows:", len(self.index), "nodes,", len(keys), "distinct edges"
+        return csr_graph.fromEdges(self.index.names,lo,hi,weights,ids=self.index.ids)
+
+    def parseChunk(self,text):
+        '''splits a chunk of whole lines into the node1, node2 and weight columns'''
+        if '"' in text or '\r' in text or ', ' in text:
+            #quoting, windows line ends or spaces to skip: let the csv module deal with it
+            rows = list(csv.reader(text.splitlines(True), skipinitialspace=True, dialect = "excel"))
+            lengths = map(len,rows)
+        else:
+            #plain "node1,node2,weight" lines, split the whole chunk at once
+            if text.endswith('\n'):
+                text = text[:-1]
+            rows = text.split('\n')
+            lengths = [count+1 for count in map(methodcaller('count',','),rows)]
+            if min(lengths) == 3 and max(lengths) == 3:
+                fields = ','.join(rows).split(',')
+                return fields[0::3], fields[1::3], fields[2::3]
+            rows = [row.split(',') for row in rows]
+
+        if min(lengths) != 3 or max(lengths) != 3:
+            #data should be 3 columns, otherwise, please reformat and try again!
+            row = rows[[k for k,length in enumerate(lengths) if length != 3][0]]
+            print 'Something has gone wrong, row of wrong length'
+            print 'Length =',len(row)
+            print 'Row text = ', row
+            sys.exit(1)
+        return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+
+    def addRows(self,n1s,n2s,weights):
+        '''interns the node names of one parsed chunk and adds its edges to the buffer'''
+        nRows = len(n1s)
+        self.nRows += nRows
+
+        ids = self.index.ids
+        newNames = set(n1s)
+        newNames.update(n2s)
+        newNames.difference_update(ids)
+        if newNames:
+            #hand out ids in order of first appearance, same as a row by row read would
+            names = [None]*(2*nRows)
+            names[0::2] = n1s
+            names[1::2] = n2s
+            firstSeen = dict(izip(reversed(names),xrange(2*nRows-1,-1,-1))) #last write wins, so the earliest position
+            for name in sorted(newNames,key=firstSeen.__getitem__):
+                self.index.intern(name)
+
+        src = np.fromiter(imap(ids.__getitem__,n1s),dtype=np.int64,count=nRows)
+        dst = np.fromiter(imap(ids.__getitem__,n2s),dtype=np.int64,count=nRows)
+        keys = (np.minimum(src,dst) << 32) | np.maximum(src,dst)
+        keys, weights = lastPerKey(keys,np.array(weights,dtype=np.float64))
+
+        self.bufferKeys.append(keys)
+        self.bufferWeights.append(weights)
+        self.nBuffered += len(keys)
+        if self.nBuffered > self.maxBufferedEdges:
+            self.spillRun()
+
+    def flushBuffer(self):
+        '''merges the buffered chunks into one sorted, de-duplicated run'''
+        if not self.bufferKeys:
+            return np.zeros(0,dtype=np.int64), np.zeros(0,dtype=np.float64)
+        keys, weights = lastPerKey(np.concatenate(self.bufferKeys),np.concatenate(self.bufferWeights))
+        self.bufferKeys = []
+        self.bufferWeights = []
+        self.nBuffered = 0
+        return keys, weights
+
+    def spillRun(self):
+        '''writes the buffer to disk as a sorted run'''
+        keys, weights = self.flushBuffer()
+        if self.runDir is None:
+            self.runDir = tempfile.mkdtemp(prefix="edge_runs_",dir=self.tmpDir)
+        runFN = os.path.join(self.runDir,"run%d" % len(self.runs))
+        np.save(runFN+"_keys.npy",keys)
+        np.save(runFN+"_weights.npy",weights)
+        self.runs.append((runFN+"_keys.npy",runFN+"_weights.npy"))
+        if self.verbose:
+            print "Spilled run", len(self.runs), "with", len(keys), "edges"
+
+    def mergeRuns(self):
+        '''merges the spilled runs (and what is left in the buffer) into one sorted, de-duplicated edge list'''
+        if not self.runs:
+            return self.flushBuffer()
+        if self.nBuffered:
+            self.spillRun()
+
+        runs = [(np.load(keysFN,mmap_mode='r'),np.load(weightsFN,mmap_mode='r')) for keysFN,weightsFN in self.runs]
+        #cut the key space in ranges holding about maxBufferedEdges edges, taken from a sample of every run
+        nTotal = sum(len(keys) for keys,weights in runs)
+        nRanges = max(1,nTotal//max(1,self.maxBufferedEdges))
+        sample = np.sort(np.concatenate([np.asarray(keys[::max(1,len(keys)//(16*nRanges))]) for keys,weights in runs]))
+        bounds = np.unique(sample[np.linspace(0,len(sample)-1,nRanges+1)[1:-1].astype(np.int64)])
+
+        outKeys = []
+        outWeights = []
+        starts = [0]*len(runs)
+        for k in xrange(len(bounds)+1):
+            pieceKeys = []
+            pieceWeights = []
+            for r,(keys,weights) in enumerate(runs):
+                end = len(keys) if k == len(bounds) else int(np.searchsorted(keys,bounds[k]))
+                #later runs come later in the file, lastPerKey keeps them
+                pieceKeys.append(np.asarray(keys[starts[r]:end]))
+                pieceWeights.append(np.asarray(weights[starts[r]:end]))
+                starts[r] = end
+            keys, weights = lastPerKey(np.concatenate(pieceKeys),np.concatenate(pieceWeights))
+            outKeys.append(keys)
+            outWeights.append(weights)
+        del runs
+        return np.concatenate(outKeys), np.concatenate(outWeights)
+
+#END Classes
+#================================
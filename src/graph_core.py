@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = graph_core.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Compact storage for the (undirected, weighted) graph modularity_cluster works on.
+
+Node names are interned once to contiguous integer ids (0..nNodes-1) and the
+adjacency is kept as CSR arrays: the neighbours of node u are
+neighbors[offsets[u]:offsets[u+1]] (sorted) with the original weights in the same
+slots of weights.  Both directions of an edge are stored, the weights only once
+(no reweighted copy, divide by totalEdges when you need it).
+
+"""
+#================================
+#Imports
+from array import array
+from itertools import izip
+
+import numpy as np
+
+#================================
+#Functions
+def nodeName(name):
+    '''node names are strings like the ones read from a CSV, anything else is turned into one'''
+    return name if isinstance(name,basestring) else str(name)
+
+def symmetricCSR(matrix):
+    '''(indptr, indices, data) of a CSR matrix that already is what csr_graph keeps: symmetric, sorted and unique indices,'''
+    '''no explicit zeros.  int64 indices and float64 data come back as they are (not copied).  None for anything else'''
+    if getattr(matrix,"format",None) != "csr" or not getattr(matrix,"has_canonical_format",False):
+        return None
+    offsets = np.asarray(matrix.indptr,dtype=np.int64)
+    cols = np.asarray(matrix.indices,dtype=np.int64)
+    vals = np.asarray(matrix.data,dtype=np.float64)
+    if not vals.all():
+        return None
+    rowIds = np.repeat(np.arange(len(offsets)-1),np.diff(offsets))
+    #symmetric if the transposed entries, sorted the same way, are the very same entries
+    order = np.lexsort((rowIds,cols))
+    if (cols[order] == rowIds).all() and (rowIds[order] == cols).all() and (vals[order] == vals).all():
+        return offsets, cols, vals
+    return None
+
+#================================
+#Classes
+class node_index(object):
+    '''interns node names to contiguous integer ids, in order of first appearance'''
+
+    def __init__(self):
+        self.ids = {}                           #name -> id
+        self.names = []                         #id -> name
+
+    def intern(self,name):
+        '''returns the id of name, handing out the next one if it has not been seen yet'''
+        nodeId = self.ids.get(name)
+        if nodeId is None:
+            nodeId = len(self.names)
+            self.ids[name] = nodeId
+            self.names.append(name)
+        return nodeId
+
+    def __len__(self):
+        return len(self.names)
+
+class csr_graph(object):
+    '''integer indexed, symmetric CSR adjacency with the original weights'''
+
+    def __init__(self,names,offsets,neighbors,weights,ids=None):
+        self.names = names                      #id -> node name
+        self._ids = ids                         #node name -> id (see ids, built the first time it is needed)
+        self.nNodes = len(names)
+        self.offsets = offsets                  #row u lives in [offsets[u],offsets[u+1])
+        self.neighbors = neighbors              #column ids, sorted inside every row
+        self.weights = weights                  #original (unreweighted) weights
+        #sum of all edges and their weights, each undirected edge once and no self loops
+        rowIds = np.repeat(np.arange(self.nNodes),np.diff(self.offsets))
+        notSelf = self.neighbors != rowIds
+        self.totalEdges = 0.5*float(self.weights[notSelf].sum())
+        #weighted degree of every node, again without self loops
+        self.degrees = np.bincount(rowIds[notSelf],weights=self.weights[notSelf],minlength=self.nNodes)
+        self.pending = {}                       #edge changes not folded into the arrays yet, pending[u][v] = new weight (0.0 = gone)
+
+    @property
+    def ids(self):
+        '''node name -> id'''
+        if self._ids is None:
+            self._ids = dict((name,nodeId) for nodeId,name in enumerate(self.names))
+        return self._ids
+
+    @classmethod
+    def fromEdges(cls,names,src,dst,weights,ids=None):
+        '''builds the graph from parallel arrays of node ids and weights (one entry per input row)'''
+        '''edges are undirected, if a pair shows up more than once the last row wins'''
+        '''ids (node name -> id) can be handed over if it is already around'''
+        nNodes = len(names)
+        src = np.asarray(src,dtype=np.int64)
+        dst = np.asarray(dst,dtype=np.int64)
+        weights = np.asarray(weights,dtype=np.float64)
+        nRows = len(src)
+
+        #both directions, interleaved so that sorting stably on (row, col) keeps input order within a pair
+        rows = np.empty(2*nRows,dtype=np.int64)
+        cols = np.empty(2*nRows,dtype=np.int64)
+        rows[0::2] = src
+        rows[1::2] = dst
+        cols[0::2] = dst
+        cols[1::2] = src
+        vals = np.repeat(weights,2)
+
+        sortKey = np.argsort(rows*max(nNodes,1) + cols,kind='mergesort')
+        rows = rows[sortKey]
+        cols = cols[sortKey]
+        vals = vals[sortKey]
+
+        #keep the last row for every (row, col) pair
+        if len(rows):
+            last = np.ones(len(rows),dtype=bool)
+            last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+            rows = rows[last]
+            cols = cols[last]
+            vals = vals[last]
+
+        offsets = np.zeros(nNodes+1,dtype=np.int64)
+        np.cumsum(np.bincount(rows,minlength=nNodes),out=offsets[1:])
+        return cls(names,offsets,cols,vals,ids=ids)
+
+    @classmethod
+    def fromArrays(cls,src,dst,weights=None,names=None):
+        '''builds the graph from in-memory edge columns, one entry per edge (weights default to 1.0)'''
+        '''integer src and dst are node ids 0..n-1, the node names are names if given (n or more of them) or the ids as'''
+        '''strings.  anything else (strings, ...) are node names, ids are handed out in order of first appearance like for'''
+        '''a CSV.  names that are not strings are turned into strings.  duplicates: the last edge for a pair wins'''
+        src = np.asarray(src)
+        dst = np.asarray(dst)
+        if src.shape != dst.shape or src.ndim != 1:
+            raise ValueError("src and dst have to be 1d and of the same length")
+        if weights is None:
+            weights = np.ones(len(src))
+        elif len(weights) != len(src):
+            raise ValueError("weights has %d entries for %d edges" % (len(weights),len(src)))
+
+        if src.dtype.kind in 'iu' and dst.dtype.kind in 'iu':
+            nNodes = int(max(src.max(),dst.max()))+1 if len(src) else 0
+            if len(src) and min(src.min(),dst.min()) < 0:
+                raise ValueError("node ids can not be negative")
+            if names is None:
+                names = [str(nodeId) for nodeId in xrange(nNodes)]
+            elif len(names) < nNodes:
+                raise ValueError("%d names for node ids up to %d" % (len(names),nNodes-1))
+            return cls.fromEdges(map(nodeName,names),src,dst,weights)
+
+        if names is not None:
+            raise ValueError("names only go with integer node ids")
+        #intern the names in order of first appearance, src and dst interleaved like the rows of a CSV
+        both = np.empty(2*len(src),dtype=np.result_type(src,dst))
+        both[0::2] = src
+        both[1::2] = dst
+        uniqueNames, first, inverse = np.unique(both,return_index=True,return_inverse=True)
+        order = np.argsort(first,kind='mergesort')
+        rank = np.empty(len(order),dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        ids = rank[inverse]
+        return cls.fromEdges(map(nodeName,uniqueNames[order].tolist()),ids[0::2],ids[1::2],weights)
+
+    @classmethod
+    def fromSparse(cls,matrix,names=None):
+        '''builds the graph from a square (scipy.sparse or anything with tocoo) adjacency matrix'''
+        '''node ids are the row numbers, names as for fromArrays.  an edge can be given in either triangle or both,'''
+        '''the upper one wins where the two differ.  explicit zeros are dropped'''
+        '''a symmetric CSR matrix with sorted indices (see symmetricCSR) is used as it is, the graph then shares its arrays'''
+        if matrix.shape[0] != matrix.shape[1]:
+            raise ValueError("adjacency matrix has to be square, not %dx%d" % matrix.shape)
+        nNodes = matrix.shape[0]
+        if names is None:
+            names = [str(nodeId) for nodeId in xrange(nNodes)]
+        elif len(names) != nNodes:
+            raise ValueError("%d names for a %dx%d matrix" % (len(names),nNodes,nNodes))
+        csr = symmetricCSR(matrix)
+        if csr is not None:
+            return cls(map(nodeName,names),*csr)
+        coo = matrix.tocoo()
+        keep = coo.data != 0
+        rows = coo.row[keep]
+        cols = coo.col[keep]
+        vals = coo.data[keep]
+        #lower triangle first, so the upper one comes last and wins
+        lower = rows > cols
+        upper = ~lower
+        return cls.fromEdges(map(nodeName,names),np.concatenate((cols[lower],rows[upper])),np.concatenate((rows[lower],cols[upper])),
+                             np.concatenate((vals[lower],vals[upper])))
+
+    @classmethod
+    def fromTuples(cls,edges):
+        '''builds the graph from an iterable of (node1, node2) or (node1, node2, weight) tuples, read once'''
+        '''node ids are handed out in order of first appearance, the last tuple for a pair wins (names as for fromArrays)'''
+        index = node_index()
+        intern = index.intern
+        src = array('l')
+        dst = array('l')
+        weights = array('d')
+        for edge in edges:
+            src.append(intern(nodeName(edge[0])))
+            dst.append(intern(nodeName(edge[1])))
+            weights.append(float(edge[2]) if len(edge) > 2 else 1.0)
+        return cls.fromEdges(index.names,np.array(src,dtype=np.int64),np.array(dst,dtype=np.int64),np.array(weights,dtype=np.float64),ids=index.ids)
+
+    def nEdges(self):
+        '''number of stored (directed) adjacency entries'''
+        return len(self.neighbors)
+
+    def row(self,u):
+        '''neighbour ids and original weights of node u'''
+        start, end = self.offsets[u], self.offsets[u+1]
+        return self.neighbors[start:end], self.weights[start:end]
+
+    def weight(self,u,v):
+        '''original weight of the edge u-v, 0.0 if there is none'''
+        cols, vals = self.row(u)
+        k = np.searchsorted(cols,v)
+        if k < len(cols) and cols[k] == v:
+            return float(vals[k])
+        return 0.0
+
+    def addNode(self,name):
+        '''adds a node without edges, returns its id (the arrays only pick it up in compacted)'''
+        nodeId = self.ids.get(name)
+        if nodeId is None:
+            nodeId = len(self.names)
+            self.ids[name] = nodeId
+            self.names.append(name)
+        return nodeId
+
+    def setWeight(self,u,v,weight):
+        '''records a new weight for the edge u-v (0.0 removes it), returns the old one'''
+        oldWeight = self.currentWeight(u,v)
+        self.pending.setdefault(u,{})[v] = weight
+        self.pending.setdefault(v,{})[u] = weight
+        return oldWeight
+
+    def currentWeight(self,u,v):
+        '''weight of the edge u-v including the pending changes'''
+        if u in self.pending and v in self.pending[u]:
+            return self.pending[u][v]
+        if u >= self.nNodes or v >= self.nNodes:
+            return 0.0
+        return self.weight(u,v)
+
+    def currentRow(self,u):
+        '''neighbour -> weight of node u including the pending changes'''
+        if u < self.nNodes:
+            cols, vals = self.row(u)
+            rowWeights = dict(izip(cols.tolist(),vals.tolist()))
+        else:
+            rowWeights = {}
+        for v,weight in self.pending.get(u,{}).iteritems():
+            if weight:
+                rowWeights[v] = weight
+            else:
+                rowWeights.pop(v,None)
+        return rowWeights
+
+    def compacted(self):
+        '''a new csr_graph with the pending changes (and added nodes) folded into the arrays'''
+        nNodes = len(self.names)
+        rowIds = np.repeat(np.arange(self.nNodes),np.diff(self.offsets))
+        upper = rowIds <= self.neighbors
+        src = rowIds[upper]
+        dst = self.neighbors[upper]
+        weights = self.weights[upper]
+
+        changes = [(u,v,weight) for u in self.pending for v,weight in self.pending[u].iteritems() if u <= v]
+        newSrc = np.array([u for u,v,weight in changes],dtype=np.int64)
+        newDst = np.array([v for u,v,weight in changes],dtype=np.int64)
+        newWeights = np.array([weight for u,v,weight in changes],dtype=np.float64)
+
+        keep = ~np.in1d(src*nNodes + dst,newSrc*nNodes + newDst)
+        present = newWeights != 0
+        return csr_graph.fromEdges(self.names,
+                                   np.concatenate((src[keep],newSrc[present])),
+                                   np.concatenate((dst[keep],newDst[present])),
+                                   np.concatenate((weights[keep],newWeights[present])),
+                                   ids=self.ids)
+
+    def connectedComponents(self):
+        '''labels every node with its connected component, numbered in order of the smallest node id in them'''
+        '''returns (nComponents, labels)'''
+        rowIds = np.repeat(np.arange(self.nNodes),np.diff(self.offsets))
+        parent = np.arange(self.nNodes)
+        while True:
+            #hook every root onto the smallest root next to it, then shortcut until everyone points at a root
+            rootsU = parent[rowIds]
+            rootsV = parent[self.neighbors]
+            hook = rootsV < rootsU
+            if not hook.any():
+                break
+            rootsU = rootsU[hook]
+            rootsV = rootsV[hook]
+            order = np.lexsort((rootsV,rootsU))
+            rootsU = rootsU[order]
+            rootsV = rootsV[order]
+            first = np.ones(len(rootsU),dtype=bool)
+            first[1:] = rootsU[1:] != rootsU[:-1]
+            parent[rootsU[first]] = np.minimum(parent[rootsU[first]],rootsV[first])
+            while True:
+                grandParent = parent[parent]
+                if (grandParent == parent).all():
+                    break
+                parent = grandParent
+        roots, labels = np.unique(parent,return_inverse=True)
+        return len(roots), labels
+
+    def rowSlots(self,nodeIds):
+        '''positions in neighbors/weights of the rows of nodeIds (any order), row after row, and the length of every row'''
+        nodeIds = np.asarray(nodeIds,dtype=np.int64)
+        starts = self.offsets[nodeIds]
+        counts = self.offsets[nodeIds+1] - starts
+        rowStarts = np.zeros(len(nodeIds),dtype=np.int64)
+        np.cumsum(counts[:-1],out=rowStarts[1:])
+        return np.repeat(starts - rowStarts,counts) + np.arange(counts.sum()), counts
+
+    def subgraph(self,nodeIds):
+        '''the graph on nodeIds (sorted array of ids) renumbered 0..len(nodeIds)-1, edges leaving the set are dropped'''
+        nodeIds = np.asarray(nodeIds,dtype=np.int64)
+        local = np.empty(self.nNodes,dtype=np.int64)
+        local.fill(-1)
+        local[nodeIds] = np.arange(len(nodeIds))
+
+        slots, counts = self.rowSlots(nodeIds)
+        cols = local[self.neighbors[slots]]
+        keep = cols >= 0
+        rowIds = np.repeat(np.arange(len(nodeIds)),counts)[keep]
+        offsets = np.zeros(len(nodeIds)+1,dtype=np.int64)
+        np.cumsum(np.bincount(rowIds,minlength=len(nodeIds)),out=offsets[1:])
+        return csr_graph([self.names[node] for node in nodeIds.tolist()],offsets,cols[keep],self.weights[slots][keep])
+
+#END Classes
+#================================
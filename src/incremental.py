@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = incremental.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Keeps an already found break up up to date while edges come and go.
+
+The community totals are kept unnormalized (sum of degrees K_C and internal weight
+in_C of every community, plus the total weight W), so an edge change only touches the
+two communities at its ends and a handful of sums -- nothing has to be rescaled when W
+moves.  Q = sum_C in_C/W - gamma*(K_C/2W)^2, gamma being the resolution.
+
+Re-optimizing starts from the current labels and only visits the ends of the changed
+edges and the members of their communities.  A node moves to the neighbouring community
+(or a fresh one of its own) that gains the most, its neighbours get another look when it
+does.  Moving node i into C gains (times W)  w_iC - gamma*k_i*K_C/(2W).
+
+"""
+#================================
+#Imports
+import numpy as np
+
+#================================
+#Classes
+class incremental_state(object):
+    '''unnormalized community totals of a labelling of a csr_graph, updated edge by edge'''
+
+    def __init__(self,graph,labels,totalEdges,resolution=1.0):
+        self.graph = graph                      #csr_graph, changes go to its pending edges
+        self.resolution = resolution            #gamma
+        self.labels = list(labels)              #node id -> community label
+        self.totalEdges = totalEdges            #W, no self loops
+        self.degrees = graph.degrees.tolist()   #k_i, no self loops
+
+        labels = np.asarray(self.labels,dtype=np.int64)
+        rowIds = np.repeat(np.arange(graph.nNodes),np.diff(graph.offsets))
+        inside = (labels[rowIds] == labels[graph.neighbors]) & (rowIds != graph.neighbors)
+        commLabels = np.unique(labels)
+        nLabels = commLabels[-1] + 1 if len(commLabels) else 0
+        commDegree = np.bincount(labels,weights=graph.degrees,minlength=nLabels)[commLabels]
+        commInternal = 0.5*np.bincount(labels[rowIds[inside]],weights=graph.weights[inside],minlength=nLabels)[commLabels]
+        commLabels = commLabels.tolist()
+        self.commDegree = dict(zip(commLabels,commDegree.tolist())) #K_C
+        self.commInternal = dict(zip(commLabels,commInternal.tolist())) #in_C, every edge once
+        self.members = dict((label,set()) for label in commLabels)
+        for node,label in enumerate(self.labels):
+            self.members[label].add(node)
+        self.nextLabel = commLabels[-1] + 1 if commLabels else 0
+
+        self.sumInternal = sum(self.commInternal.itervalues())
+        self.sumDegree2 = sum(K*K for K in self.commDegree.itervalues())
+
+    def Q(self):
+        '''modularity of the current labels'''
+        if self.totalEdges <= 0:
+            return 0.0
+        return self.sumInternal/self.totalEdges - self.resolution*self.sumDegree2/(4*self.totalEdges*self.totalEdges)
+
+    def nodeId(self,name):
+        '''id of the node called name, new nodes start out in a community of their own'''
+        nodeId = self.graph.addNode(name)
+        if nodeId == len(self.labels):
+            label = self.nextLabel
+            self.newCommunity(label)
+            self.members[label].add(nodeId)
+            self.labels.append(label)
+            self.degrees.append(0.0)
+        return nodeId
+
+    def newCommunity(self,label):
+        '''an empty community called label'''
+        self.commDegree[label] = 0.0
+        self.commInternal[label] = 0.0
+        self.members[label] = set()
+        self.nextLabel = max(self.nextLabel,label+1)
+
+    def addDegree(self,label,delta):
+        '''K_C += delta, keeping sum K_C^2 in step'''
+        K = self.commDegree[label]
+        self.sumDegree2 += (K+delta)*(K+delta) - K*K
+        self.commDegree[label] = K + delta
+
+    def addInternal(self,label,delta):
+        '''in_C += delta, keeping sum in_C in step'''
+        self.sumInternal += delta
+        self.commInternal[label] += delta
+
+    def setWeight(self,u,v,weight):
+        '''sets the weight of edge u-v (0.0 removes it) and fixes up the totals'''
+        delta = weight - self.graph.setWeight(u,v,weight)
+        if u == v or delta == 0:
+            return #self loops never count
+        self.totalEdges += delta
+        self.degrees[u] += delta
+        self.degrees[v] += delta
+        self.addDegree(self.labels[u],delta)
+        self.addDegree(self.labels[v],delta)
+        if self.labels[u] == self.labels[v]:
+            self.addInternal(self.labels[u],delta)
+
+    def reoptimize(self,nodes,maxSweeps=50):
+        '''local moves starting from nodes (and the members of their communities), returns the number of moves'''
+        active = set(nodes)
+        for node in nodes:
+            active.update(self.members[self.labels[node]])
+
+        nMoves = 0
+        for sweep in xrange(maxSweeps):
+            if not active:
+                break
+            queue = sorted(active)
+            active = set()
+            for i in queue:
+                moved = self.moveNode(i)
+                if moved is not None:
+                    nMoves += 1
+                    active.update(moved)
+        return nMoves
+
+    def moveNode(self,i):
+        '''moves node i to where it gains the most, returns the neighbours to look at again (None if it stayed)'''
+        twoW = 2*self.totalEdges
+        if twoW <= 0:
+            return None
+        row = self.graph.currentRow(i)
+        row.pop(i,None)
+        weightTo = {}
+        for j,weight in row.iteritems():
+            c = self.labels[j]
+            weightTo[c] = weightTo.get(c,0.0) + weight
+
+        current = self.labels[i]
+        ki = self.degrees[i]
+        #take i out
+        self.addDegree(current,-ki)
+        self.addInternal(current,-weightTo.get(current,0.0))
+        stayGain = weightTo.get(current,0.0) - self.resolution*ki*self.commDegree[current]/twoW
+        best = current
+        bestGain = stayGain
+        for c,w in weightTo.iteritems():
+            gain = w - self.resolution*ki*self.commDegree[c]/twoW
+            if gain > bestGain or (gain == bestGain and best != current and c < best):
+                best = c
+                bestGain = gain
+        if bestGain < 0 and len(self.members[current]) > 1:
+            #better off on its own
+            best = self.nextLabel
+            self.newCommunity(best)
+        #put i back in
+        self.addDegree(best,ki)
+        self.addInternal(best,weightTo.get(best,0.0))
+        if best == current:
+            return None
+
+        self.labels[i] = best
+        self.members[current].discard(i)
+        self.members[best].add(i)
+        if not self.members[current]:
+            del self.members[current]
+            del self.commDegree[current]
+            del self.commInternal[current]
+        return [j for j in row if self.labels[j] != best]
+
+#END Classes
+#================================
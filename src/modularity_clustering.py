@@ -23,53 +23,287 @@ It clusters based on maximizing modularity.
 #================================
 #Imports
 import sys
+import os
 import math
-from copy import deepcopy as dcopy
+import time
+import glob
+import hashlib
+import argparse
 
 from operator import itemgetter
 
 import json
-import csv
 import pprint
+import heapq
+from array import array
 
 from collections import defaultdict
+from itertools import izip, imap
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import ctypes
 
-from sets import Set
+import numpy as np
+
+from graph_core import csr_graph
+from edge_stream import edge_stream
+from multilevel import multilevelPartition, aggregate, moveNodes, coarseQ
+from incremental import incremental_state
+from cluster_model import saveModel
+from checkpoint import checkpoint_writer, loadArrays
 
 #================================
 #Classes
+class merge_log(object):
+    '''array backed record of every join (i, j, deltaQ), in the order they were done'''
+
+    def __init__(self):
+        self.i = array('l')
+        self.j = array('l')
+        self.deltaQ = array('d')
+
+    def append(self,i,j,deltaQ):
+        self.i.append(i)
+        self.j.append(j)
+        self.deltaQ.append(deltaQ)
+
+    def __len__(self):
+        return len(self.i)
+
+    def __getitem__(self,k):
+        return self.i[k], self.j[k], self.deltaQ[k]
+
+class community(object):
+    '''one live community of the greedy joins: its sparse row of e to the other communities and its e_ii'''
+    __slots__ = ("e","eii")
+
+    def __init__(self,e,eii=0.0):
+        self.e = e                              #other community -> e_ij, only the nonzero ones
+        self.eii = eii
+
+class run_summary(object):
+    '''what one findCommunities call did, returned by it'''
+
+    def __init__(self,method):
+        self.method = method                    #"greedy", "multilevel" or "byComponent"
+        self.phases = {}                        #phase name -> wall seconds, for every phase timed so far
+        self.counters = {}                      #heap/dict operation -> count, empty unless countOperations is on
+        self.nMerges = 0                        #joins done (greedy), levels (multilevel) or components (byComponent)
+        self.nPasses = 0                        #passes of the join loop (greedy), one per join plus the last unless joins were batched
+        self.strictMaxQValue = None             #best Q of the one join per pass run, if findCommunities was asked to compare
+        self.maxQValue = 0                      #best Q found
+        self.nClusters = 0                      #number of communities at the best Q
+        self.seconds = 0.0                      #wall time of the whole call
+
+    def __repr__(self):
+        return "run_summary(method=%r, maxQValue=%r, nClusters=%d, nMerges=%d, seconds=%.3f)" % (self.method,self.maxQValue,self.nClusters,self.nMerges,self.seconds)
+
 class modularity_cluster(object):
     '''modality clustering for simple weighted matrices'''
 
-    def __init__(self, verbose=True):
+    def __init__(self, verbose=True, resolution=1.0):
         self.verbose = verbose                  #if you want it to give helpful comments
+        self.resolution = resolution            #gamma in Q = sum_i e_ii - gamma*a_i^2, bigger gives smaller communities (1 is plain modularity)
         self.nNodes = 0                         #number of nodes in graph
-        self.nodes = Set()                      #node names
-        self.edgeData = {}                      #edge data (weights divided by total weight)
+        self.nodes = []                         #node names, indexed by node id
+        self._graph = None                      #csr_graph holding the edges (original weights), see graph_core and graph
+        self.incremental = None                 #incremental_state once updateEdges has been called
         self.comparableCommunities = set()         #communities which still have outgoing edges
-        self.deltaQs = {}
-
-        self.currCommunityData = {}             #current grouping data
+        self.deltaQs = {}                       #deltaQs[i][j] for i<j, the authoritative values
+        self.rowHeaps = {}                      #per community max-heap of (-deltaQ, j), stale entries skipped lazily
+        self.maxHeap = []                       #global heap of row maxima (-deltaQ, i, j)
+
+        self.communities = {}                   #community id (its smallest node id) -> community, while joining
+        self.aValues = array('d')               #a of every community, by community id
+        self.parent = array('l')                #union-find: node id -> the community it was folded into (itself for a root)
+        self.nextMember = array('l')            #members of a community as a linked list from its id in join order, -1 ends it
+        self.lastMember = array('l')            #last node of that list, for every community id
+        self._currCommunityData = {}            #current grouping data (see currCommunityData, built lazily from the above)
         self.currQValue = 0                     #current value of Q, modularity
-        self.maxQValueCommData = {}             #current found break up that maximizes Q
+        self._maxQValueCommData = {}            #current found break up that maximizes Q (see maxQValueCommData, built lazily)
+        self.mergeLog = merge_log()             #every join done so far, the dendrogram
+        self.maxQStep = 0                       #number of joins in mergeLog that gave the max Q
         self.maxQValue = 0                      #current max value of Q
         self.header = ""                        #if hte CSV has a header, it will be stored here
         self.isDone = False                     #checks if the algorithm is done doing it's thing
-        self.originalData = {}                  #the original, unreweighted data
         self.totalEdges = 0                     #sum of all edges and their weights.
         self.pp = pprint.PrettyPrinter(indent=4) #no one likes to look at gross dictionaries, make them look pretty
         if self.verbose:
             print "All done initiating, please call modularity_cluster.loadEdges(filename(CSV!), ignoreHeader=BOOL) now to load a CSV"
-        self.currMembership = {}                #holds current round membership data
-        self.membership={} #                    #holds max("true") membership data
+        self._currMembership = {}               #holds current round membership data (see currMembership, built lazily)
+        self._membership={} #                   #holds max("true") membership data (see membership, built lazily)
         self.QPath = []                         #holds the history of Q values
         self.tiny = 0.000000000000000000000000000001
         self.stopAtNegativeDeltaQ = False
 
+        #instrumentation, all off unless set
+        self.timings = {}                       #phase name -> wall seconds of its last run, always kept (one clock read per phase)
+        self.onPhase = None                     #called as onPhase(name, seconds) at the end of every phase
+        self.onMerge = None                     #called as onMerge(step, i, j, deltaQ, Q) after every onMergeEvery-th join
+        self.onMergeEvery = 1
+        self.counters = None                    #operation -> count, set countOperations = True to fill it
+
+    @property
+    def graph(self):
+        '''the loaded csr_graph, with the edge changes of updateEdges folded in the first time it is asked for'''
+        if self._graph is not None and (self._graph.pending or len(self._graph.names) != self._graph.nNodes):
+            self._graph = self._graph.compacted()
+            self.nodes = self._graph.names
+            self.nNodes = self._graph.nNodes
+            self.totalEdges = self._graph.totalEdges
+            if self.incremental is not None:
+                self.incremental.graph = self._graph
+                self.incremental.totalEdges = self.totalEdges
+        return self._graph
+
+    @graph.setter
+    def graph(self,graph):
+        self._graph = graph
+
+    @property
+    def currCommunityData(self):
+        '''community data (members, e, a) of the current communities, built from the join state the first time it is asked for'''
+        if self._currCommunityData is None:
+            self._currCommunityData = self.liveCommunityData()
+        return self._currCommunityData
+
+    @currCommunityData.setter
+    def currCommunityData(self,commData):
+        self._currCommunityData = commData
+
+    @property
+    def currMembership(self):
+        '''node -> current community, read off the union-find parents the first time it is asked for'''
+        if self._currMembership is None:
+            self._currMembership = dict(izip(self.nodes,self.currentRoots().tolist()))
+        return self._currMembership
+
+    @currMembership.setter
+    def currMembership(self,membership):
+        self._currMembership = membership
+
+    @property
+    def countOperations(self):
+        '''whether the heap and dict operations of the joins are counted in counters'''
+        return self.counters is not None
+
+    @countOperations.setter
+    def countOperations(self,count):
+        if not count:
+            self.counters = None
+        elif self.counters is None:
+            self.counters = defaultdict(int)
+
+    def endPhase(self,name,start):
+        '''records the wall time of phase name started at start (time.time()) and tells onPhase'''
+        seconds = time.time() - start
+        self.timings[name] = seconds
+        if self.onPhase is not None:
+            self.onPhase(name,seconds)
+        return seconds
+
+    @property
+    def maxQValueCommData(self):
+        '''community data for the max Q break up, built the first time it is asked for:'''
+        '''replayed from the merge log, or from the labels kept up to date by updateEdges'''
+        if self._maxQValueCommData is None:
+            if self.incremental is not None:
+                labels = np.asarray(self.incremental.labels,dtype=np.int64)
+                self._maxQValueCommData = self.communityDataForLabels(labels,commIds=np.unique(labels).tolist())
+            else:
+                self._maxQValueCommData = self.cutDendrogram(step=self.maxQStep)
+        return self._maxQValueCommData
+
+    @maxQValueCommData.setter
+    def maxQValueCommData(self,commData):
+        self._maxQValueCommData = commData
+        self._membership = None
+
+    @property
+    def membership(self):
+        '''node -> community for the max Q break up, inverted from maxQValueCommData when first asked for'''
+        '''(or read off the labels of updateEdges, without building the community data)'''
+        if self._membership is None:
+            if self.incremental is not None:
+                self._membership = dict(izip(self.nodes,self.incremental.labels))
+            else:
+                self.updateMaxMembership()
+        return self._membership
+
+    @membership.setter
+    def membership(self,membership):
+        self._membership = membership
+
     def updateMaxMembership(self):
+        self._membership = {}
         for comm in self.maxQValueCommData:
             for node in self.maxQValueCommData[comm]["members"]:
-                self.membership[node]=comm
+                self._membership[node]=comm
+
+    def cutDendrogram(self,step=None,nClusters=None):
+        '''returns community data (same layout as maxQValueCommData) after the first step joins of the merge log'''
+        '''or, with nClusters, at the point where nClusters communities were left.  Does not rerun the clustering'''
+        if nClusters is not None:
+            step = self.nNodes - nClusters
+        if step is None:
+            step = self.maxQStep
+        if step < 0 or step > len(self.mergeLog):
+            raise ValueError("can only cut between 0 and %d joins (%d to %d clusters), asked for %d joins" % (len(self.mergeLog), self.nNodes, self.nNodes-len(self.mergeLog), step))
+
+        nextMember = array('l',[-1])*self.nNodes
+        lastMember = array('l',xrange(self.nNodes))
+        parent = np.arange(self.nNodes)
+        for i,j in izip(self.mergeLog.i[:step],self.mergeLog.j[:step]):
+            nextMember[lastMember[i]] = j
+            lastMember[i] = lastMember[j]
+            parent[j] = i
+        return self.communityDataForRoots(rootsOf(parent),nextMember)
+
+    def communityDataForRoots(self,roots,nextMember):
+        '''community data (members, e, a) keyed on community id, for the community id of every node and the member lists in nextMember'''
+        coarse, coarseMap = self.collapseLabels(roots)
+        offsets, cols, eValues, selfE, a = [x.tolist() for x in coarse]
+        commIds = np.unique(roots).tolist()
+
+        #every node id goes in first (and the others out again), so the communities come out in id order like they always have
+        commData = dict.fromkeys(xrange(self.nNodes))
+        for node,root in enumerate(roots.tolist()):
+            if root != node:
+                del commData[node]
+        names = self.nodes
+        for k,comm in enumerate(commIds):
+            members = []
+            node = comm
+            while node != -1:
+                members.append(names[node])
+                node = nextMember[node]
+            e = defaultdict(float,izip([commIds[c] for c in cols[offsets[k]:offsets[k+1]]],eValues[offsets[k]:offsets[k+1]]))
+            e[comm] = selfE[k]
+            commData[comm] = {"members":members,"e":e,"a":a[k]}
+        return commData
+
+    def liveCommunityData(self):
+        '''community data (members, e, a) of the communities of the greedy joins as they are now'''
+        commData = dict.fromkeys(xrange(self.nNodes))
+        for node in xrange(self.nNodes):
+            if node not in self.communities:
+                del commData[node]
+        names = self.nodes
+        nextMember = self.nextMember
+        for comm,data in self.communities.iteritems():
+            members = []
+            node = comm
+            while node != -1:
+                members.append(names[node])
+                node = nextMember[node]
+            e = defaultdict(float,data.e)
+            e[comm] = data.eii
+            commData[comm] = {"members":members,"e":e,"a":self.aValues[comm]}
+        return commData
+
+    def currentRoots(self):
+        '''the current community id of every node, as an array'''
+        return rootsOf(np.frombuffer(self.parent,dtype=np.dtype('l')) if self.parent else np.arange(self.nNodes))
 
     def updateCurrMembershipAll(self):
         '''currMembership is an inversion of community data for fast checking of which community a member belongs to'''
@@ -83,65 +317,66 @@ class modularity_cluster(object):
 
     def getMembership(self,node):
         '''returns the index of the community to which node belongs to -- for current max!'''
+        if self.incremental is not None:
+            #straight from the labels updateEdges keeps, the graph is not compacted and nothing is rebuilt
+            return self.incremental.labels[self._graph.ids[node]]
         return self.membership[node]
 
     def areInSameComm(self,node1,node2):
         '''tests if two nodes are in the same community -- for current max!'''
-        if self.membership[node1] == self.membership[node2]:
+        if self.getMembership(node1) == self.getMembership(node2):
             return True
         else:
             return False
 
-    def loadEdges(self,fn,ignoreHeader = False):
+    def loadEdges(self,fn,ignoreHeader = False,chunkBytes=32*1024*1024,maxBufferedEdges=20000000,tmpDir=None):
         '''takes a filename and reads it in'''
         '''file format: CSV: node1, node2, weight'''
         '''send ignoreHeader=True if want to ignore first line)'''
-        loadFile=open(fn,'rb')
-        inputCSV=csv.reader(loadFile, skipinitialspace=True, dialect = "excel")
-        if (ignoreHeader):
-            self.header = inputCSV.next()
-
-        for row in inputCSV:
-            if len(row)==3:
-                n1 = row[0]
-                n2 = row[1]
-                weight = float(row[2]) 
-                self.edgeData[(n1,n2)]=weight
-                self.originalData[(n1,n2)]=weight
-                self.edgeData[(n2,n1)]=weight
-                self.originalData[(n2,n1)]=weight #let's keep the original data around, mmkay?
-                self.nodes.add(n1)
-                self.nodes.add(n2)
-
-            else:
-                #data should be 3 columns, otherwise, please reformat and try again!
-                print 'Something has gone wrong, row of wrong length'
-                print 'Length =',len(row)
-                print 'Row text = ', row
-                sys.exit(1)
-
-        loadFile.close()
-        #make my life easy and make sure all keys used exist.
-        factor = 0.5
-        for n1 in self.nodes:
-            for n2 in self.nodes:
-                if n1 != n2:
-                    if self.edgeData.has_key((n1,n2)):
-                        self.totalEdges += factor*self.edgeData[(n1,n2)]
-
+        '''the file is streamed in chunks of about chunkBytes, past maxBufferedEdges distinct edges sorted runs are spilled to tmpDir (see edge_stream)'''
+        start = time.time()
+        stream = edge_stream(chunkBytes=chunkBytes,maxBufferedEdges=maxBufferedEdges,tmpDir=tmpDir,verbose=self.verbose)
+        graph = stream.load(fn,ignoreHeader=ignoreHeader)
+        self.endPhase("loadEdges",start)
+        if ignoreHeader:
+            self.header = stream.header
+        self.setUpGraph(graph)
+
+    def loadEdgeArrays(self,src,dst,weights=None,names=None):
+        '''takes the edges as in-memory columns instead of a CSV (see csr_graph.fromArrays)'''
+        '''integer src, dst are node ids 0..n-1 (named by names, or the ids as strings), anything else are node names'''
+        self.loadGraph(csr_graph.fromArrays,src,dst,weights,names)
+
+    def loadSparseMatrix(self,matrix,names=None):
+        '''takes a square scipy.sparse adjacency matrix instead of a CSV (see csr_graph.fromSparse)'''
+        self.loadGraph(csr_graph.fromSparse,matrix,names)
+
+    def loadEdgeTuples(self,edges):
+        '''takes an iterable of (node1, node2[, weight]) tuples instead of a CSV (see csr_graph.fromTuples)'''
+        self.loadGraph(csr_graph.fromTuples,edges)
+
+    def loadGraph(self,build,*args):
+        '''builds the csr_graph with build(*args), timed as the loadEdges phase, and sets up on it'''
+        start = time.time()
+        graph = build(*args)
+        self.endPhase("loadEdges",start)
+        self.setUpGraph(graph)
+
+    def setUpGraph(self,graph,totalEdges=None):
+        '''takes a csr_graph (see graph_core) and sets up the single node communities on it'''
+        '''totalEdges overrides the weight e and a are normalized by (for a piece of a bigger graph)'''
+        self.graph = graph
+        self.nodes = graph.names
+        self.totalEdges = graph.totalEdges if totalEdges is None else totalEdges
 
         if self.verbose:
-            print "node1, node2, weight"
-            for n1,n2 in self.edgeData:
-                print n1,n2,self.edgeData[(n1,n2)]
-
-
-        for key in self.edgeData: #reweight by total value
-            self.edgeData[key] = self.edgeData[key]/self.totalEdges
+            print "Graph has", graph.nNodes, "nodes and total edge weight", self.totalEdges
 
         self.nNodes = len(self.nodes)
         #now we set up the current communities with nNodes number of communities
+        start = time.time()
         self.setUpCommunity()
+        self.endPhase("setUpCommunity",start)
         if self.verbose:
             print "All done setting up, now call findCommunities(stopAtFirstNegativeDeltaQ=BOOL)"
 
@@ -155,6 +390,8 @@ class modularity_cluster(object):
         '''gets rid of small clusters'''
         if self.verbose:
             print "Removing clusters smaller than", minClusterSize
+        #membership keeps covering the removed nodes, as it did before the break up was built lazily
+        self.membership
         clustersRemoved = 0
         for comm in self.maxQValueCommData.keys():
             if len(self.maxQValueCommData[comm]["members"]) < minClusterSize:
@@ -174,60 +411,479 @@ class modularity_cluster(object):
 
         oF.close()
 
-    def findJoinAndUpdateQ(self):
+    def findJoinAndUpdateQ(self,batchTolerance=None):
         '''this method goes through one pass of algorithm and combines two communities together'''
+        '''with batchTolerance it joins every disjoint pair with deltaQ > 0 and within batchTolerance (relative) of the best one instead'''
         #this is the bread and butter, it passes through the community, first checking if it's done or not, and finds the join that maxes DeltaQ and then does the join
 
-        if len(self.currCommunityData)==1 or len(self.comparableCommunities)==0:
-            #"All done!"
+        nextPair = None
+        if len(self.communities)>1 and len(self.comparableCommunities)>0:
+            nextPair = self.findNextPair()
+
+        if nextPair is None:
+            #"All done!" (one community left, or no pair left to join)
+            self.isDone = True
+            self._membership = None
+            if self.verbose:
+                self.printDone()
+            return
+
+        if batchTolerance is not None and nextPair[0] > 0:
+            #disjoint pairs do not change each other's deltaQ, so the joins add up exactly
+            for deltaQ, (i,j) in self.findNextPairs(nextPair[0]*(1-batchTolerance)):
+                self.joinAndUpdateQ(i,j,deltaQ)
+            return
+
+        deltaQ, (i,j) = nextPair
+        self.joinAndUpdateQ(i,j,deltaQ)
+        if deltaQ < 0 and self.stopAtNegativeDeltaQ:
             self.isDone = True
-            self.updateMaxMembership()
+            self._membership = None
             if self.verbose:
-                print "DONE: Max Q value found:", self.maxQValue            
-                print "If you want to print the output please call: printClustersJSON(outputFile=\"communities.json\")"
-                print "For convenient printing with gnuplot please call: printgnu(filename=\"gnuOut.dat\") (plot w/ 'u 3:4:5')"
-                print "For using with network analysis (MR) call: printMR(outputFile=\"MR_output.dat\")"
-                print "This is the Q path starting from the first Q computed (all separated)"
-                for elem in self.QPath:
-                    if self.maxQValue > elem - self.tiny and self.maxQValue < elem + self.tiny:
-                        print elem, "MAX"
-                    else:
-                        print elem
+                self.printDone()
             return
 
-        deltaQ, (i,j) = self.findNextPair()
+    def joinAndUpdateQ(self,i,j,deltaQ):
+        '''joins i and j and keeps Q, the merge log and the max Q up to date'''
         self.joinNextPair(i,j)
         self.currQValue+=deltaQ
+        self.mergeLog.append(i,j,deltaQ)
+        if self.onMerge is not None and len(self.mergeLog) % self.onMergeEvery == 0:
+            self.onMerge(len(self.mergeLog),i,j,deltaQ,self.currQValue)
         #self.computeQ()
         if self.currQValue > self.maxQValue:
             self.maxQValue = self.currQValue
-            self.maxQValueCommData = dcopy(self.currCommunityData)
-        if deltaQ < 0 and self.stopAtNegativeDeltaQ:
-            self.isDone = True
-            self.updateMaxMembership()
-            if self.verbose:
-                print "DONE: Max Q value found:", self.maxQValue            
-                print "If you want to print the output please call: printClustersJSON(outputFile=\"communities.json\")"
-                print "For convenient printing with gnuplot please call: printgnu(filename=\"gnuOut.dat\") (plot w/ 'u 3:4:5')"
-                print "For using with network analysis (MR) call: printMR(outputFile=\"MR_output.dat\")"
-                print "This is the Q path starting from the first Q computed (all separated)"
-                for elem in self.QPath:
-                    if self.maxQValue > elem - self.tiny and self.maxQValue < elem + self.tiny:
-                        print elem, "MAX"
-                    else:
-                        print elem
-            return
+            self.maxQStep = len(self.mergeLog)
+            self.maxQValueCommData = None
+
+    def printDone(self):
+        '''tells you what you found and what to do next'''
+        print "DONE: Max Q value found:", self.maxQValue            
+        print "If you want to print the output please call: printClustersJSON(outputFile=\"communities.json\")"
+        print "For convenient printing with gnuplot please call: printgnu(filename=\"gnuOut.dat\") (plot w/ 'u 3:4:5')"
+        print "For using with network analysis (MR) call: printMR(outputFile=\"MR_output.dat\")"
+        print "This is the Q path starting from the first Q computed (all separated)"
+        for elem in self.QPath:
+            if self.maxQValue > elem - self.tiny and self.maxQValue < elem + self.tiny:
+                print elem, "MAX"
+            else:
+                print elem
 
-    def findCommunities(self,stopAtFirstNegativeDeltaQ = True):
-        self.stopAtNegativeDeltaQ = stopAtFirstNegativeDeltaQ
+    def findCommunities(self,stopAtFirstNegativeDeltaQ = True,method="greedy",checkpointFile=None,checkpointEvery=None,checkpointSeconds=300.0,resumeFrom=None,refine=False,
+                        batchTolerance=None,compareStrict=False):
         '''call this routine to actually do the loop'''
+        '''method="greedy" joins pairs of communities one at a time (Newman), method="multilevel" runs findCommunitiesMultilevel'''
+        '''greedy only: batchTolerance=t joins, in every pass, all disjoint pairs with deltaQ > 0 and >= (1-t) times the best one (QPath gets one Q per pass)'''
+        '''compareStrict=True also runs the one join per pass version on the same graph and puts its max Q in the summary (strictMaxQValue)'''
+        '''greedy only: with checkpointFile the join state is saved there every checkpointEvery joins and/or checkpointSeconds seconds (see checkpoint)'''
+        '''resumeFrom=checkpoint file carries on from there (load the same graph first), ending with the same result as an uninterrupted run'''
+        '''refine=True runs refineCommunities on the result'''
+        '''returns a run_summary'''
+        if method not in ("greedy","multilevel"):
+            raise ValueError("unknown method %r, use \"greedy\" or \"multilevel\"" % (method,))
+        if method != "greedy" and (resumeFrom is not None or checkpointFile is not None):
+            raise ValueError("checkpoints (checkpointFile, resumeFrom) only work with method=\"greedy\", not %r" % (method,))
+        if method != "greedy" and (batchTolerance is not None or compareStrict):
+            raise ValueError("batchTolerance and compareStrict only work with method=\"greedy\", not %r" % (method,))
+        if batchTolerance is not None and not 0 <= batchTolerance <= 1:
+            raise ValueError("batchTolerance has to be between 0 and 1, not %r" % (batchTolerance,))
+        if method == "multilevel":
+            summary = self.findCommunitiesMultilevel()
+            return self.refineSummary(summary) if refine else summary
+
+        start = time.time()
+        if resumeFrom is not None:
+            self.restoreCheckpoint(resumeFrom) #stopAtFirstNegativeDeltaQ comes from the checkpoint
+        else:
+            self.stopAtNegativeDeltaQ = stopAtFirstNegativeDeltaQ
+        checkpoint = None
+        if checkpointFile is not None:
+            checkpoint = checkpoint_writer(checkpointFile,every=checkpointEvery,seconds=checkpointSeconds)
+            checkpoint.lastStep = len(self.mergeLog)
         i = 0
         while not self.isDone:
             i+=1
             if i%50 == 0 and self.verbose:
-                print "Clustering Pass", i
-            self.findJoinAndUpdateQ()
+                print "Clustering Pass", i, "Q =", self.currQValue, "after %.2f s" % (time.time()-start)
+            self.findJoinAndUpdateQ(batchTolerance)
             self.QPath.append(self.currQValue)
+            if checkpoint is not None and checkpoint.due(len(self.mergeLog)):
+                checkpoint.write(len(self.mergeLog),self.checkpointArrays)
+        if checkpoint is not None:
+            checkpoint.wait()
+        summary = self.summarize("greedy",start,len(self.mergeLog),self.nNodes-self.maxQStep)
+        summary.nPasses = i
+        if compareStrict:
+            strict = self.strictRun(self.stopAtNegativeDeltaQ)
+            summary.strictMaxQValue = strict.maxQValue
+            if self.verbose:
+                print "Max Q", self.maxQValue, "in", i, "passes, one join per pass gives", strict.maxQValue, "in", strict.nPasses, "passes"
+        return self.refineSummary(summary) if refine else summary
+
+    def strictRun(self,stopAtFirstNegativeDeltaQ=True):
+        '''run_summary of the plain one join per pass greedy run on the same graph, this one is left alone'''
+        strict = modularity_cluster(verbose=False,resolution=self.resolution)
+        strict.setUpGraph(self.graph,self.totalEdges)
+        return strict.findCommunities(stopAtFirstNegativeDeltaQ=stopAtFirstNegativeDeltaQ)
+
+    def refineSummary(self,summary):
+        '''runs refineCommunities after a findCommunities and brings its run_summary up to date'''
+        self.refineCommunities()
+        summary.maxQValue = self.maxQValue
+        summary.nClusters = len(self.maxQValueCommData)
+        summary.phases = dict(self.timings)
+        return summary
+
+    def refineCommunities(self,maxSweeps=10,tolerance=1e-10):
+        '''moves single nodes between the communities of the max Q break up for as long as that raises Q'''
+        '''every sweep is O(E) (see multilevel.moveNodes), the joins are not redone.  returns the gain in Q'''
+        start = time.time()
+        commIds, labels, order = self.clusterLabels()
+        if (labels < 0).any():
+            raise ValueError("can not refine after removeLargerClusters, not every node is in a cluster")
+        offsets, cols, eValues, a = self.singletonArrays()
+        labels, moved = moveNodes(offsets,cols,eValues,a,maxSweeps=maxSweeps,tolerance=tolerance,resolution=self.resolution,labels=labels)
+        gain = 0.0
+        if moved:
+            labels = np.asarray(labels,dtype=np.int64)
+            Q = self.scoreLabels(labels)
+            if Q > self.maxQValue:
+                gain = Q - self.maxQValue
+                self.maxQValue = Q
+                self.currQValue = Q
+                self.QPath.append(Q)
+                self.currCommunityData = self.communityDataForLabels(labels)
+                self.maxQValueCommData = self.currCommunityData
+                self.incremental = None #updateEdges starts over from the refined membership
+        self.endPhase("refineCommunities",start)
+        if self.verbose:
+            print "Refined the communities, Q is now", self.maxQValue, "(up %g)" % (gain,)
+        return gain
+
+    def scorePartition(self,assignment):
+        '''Q (at this resolution) of any node -> cluster assignment on the loaded graph, leaves the clustering alone'''
+        '''assignment: dict of node name -> cluster (any hashable, nodes left out are clusters of their own)'''
+        '''or a sequence of clusters by node id (same order as nodes)'''
+        if isinstance(assignment,dict):
+            clusters = [assignment.get(node) for node in self.nodes]
+        else:
+            clusters = list(assignment)
+            if len(clusters) != self.nNodes:
+                raise ValueError("assignment has %d entries, the graph %d nodes" % (len(clusters),self.nNodes))
+        codes = {}
+        labels = np.empty(self.nNodes,dtype=np.int64)
+        for node,cluster in enumerate(clusters):
+            if cluster is None:
+                labels[node] = len(codes)
+                codes[(None,node)] = labels[node]
+            else:
+                labels[node] = codes.setdefault(cluster,len(codes))
+        return self.scoreLabels(labels)
+
+    def scoreLabels(self,labels):
+        '''Q (at this resolution) of an array of cluster labels by node id, 0 <= label < nNodes'''
+        offsets, cols, eValues, a = self.singletonArrays()
+        rowIds = np.repeat(np.arange(self.nNodes),np.diff(offsets))
+        inside = labels[rowIds] == labels[cols]
+        aTot = np.bincount(labels,weights=a,minlength=self.nNodes)
+        return float(eValues[inside].sum() - self.resolution*(aTot**2).sum())
+
+    def checkpointArrays(self):
+        '''the whole state of the greedy joins as flat arrays, for checkpoint.saveArrays (read back by restoreCheckpoint)'''
+        commIds = sorted(self.communities)
+        eCols = []
+        eValues = []
+        for comm in commIds:
+            e = self.communities[comm].e
+            eCols.extend(e.iterkeys())
+            eValues.extend(e.itervalues())
+        rowIds = sorted(self.deltaQs)
+        deltaQCols = []
+        deltaQValues = []
+        for comm in rowIds:
+            row = self.deltaQs[comm]
+            deltaQCols.extend(row.iterkeys())
+            deltaQValues.extend(row.itervalues())
+        return {"nNodes":np.int64(self.nNodes),
+                "totalEdges":np.float64(self.totalEdges),
+                "currQValue":np.float64(self.currQValue),
+                "maxQValue":np.float64(self.maxQValue),
+                "maxQStep":np.int64(self.maxQStep),
+                "stopAtNegativeDeltaQ":np.bool_(self.stopAtNegativeDeltaQ),
+                "resolution":np.float64(self.resolution),
+                "isDone":np.bool_(self.isDone),
+                "commIds":np.array(commIds,dtype=np.int64),
+                "eCounts":np.array([len(self.communities[comm].e) for comm in commIds],dtype=np.int64),
+                "eCols":np.array(eCols,dtype=np.int64),
+                "eValues":np.array(eValues,dtype=np.float64),
+                "eii":np.array([self.communities[comm].eii for comm in commIds],dtype=np.float64),
+                "aValues":np.array(self.aValues,dtype=np.float64),
+                "parent":np.array(self.parent,dtype=np.int64),
+                "nextMember":np.array(self.nextMember,dtype=np.int64),
+                "lastMember":np.array(self.lastMember,dtype=np.int64),
+                "deltaQRows":np.array(rowIds,dtype=np.int64),
+                "deltaQCounts":np.array([len(self.deltaQs[comm]) for comm in rowIds],dtype=np.int64),
+                "deltaQCols":np.array(deltaQCols,dtype=np.int64),
+                "deltaQValues":np.array(deltaQValues,dtype=np.float64),
+                "comparable":np.array(sorted(self.comparableCommunities),dtype=np.int64),
+                "mergeI":np.array(self.mergeLog.i,dtype=np.int64),
+                "mergeJ":np.array(self.mergeLog.j,dtype=np.int64),
+                "mergeDeltaQ":np.array(self.mergeLog.deltaQ,dtype=np.float64),
+                "QPath":np.array(self.QPath,dtype=np.float64)}
+
+    def restoreCheckpoint(self,fn):
+        '''puts the greedy join state saved in the checkpoint fn back, on top of the same graph'''
+        arrays = loadArrays(fn)
+        if int(arrays["nNodes"]) != self.nNodes or float(arrays["totalEdges"]) != self.totalEdges:
+            raise ValueError("checkpoint %s is for a graph with %d nodes and total weight %r, this one has %d nodes and total weight %r"
+                             % (fn,int(arrays["nNodes"]),float(arrays["totalEdges"]),self.nNodes,self.totalEdges))
+
+        eCols = arrays["eCols"].tolist()
+        eValues = arrays["eValues"].tolist()
+        eii = arrays["eii"].tolist()
+        start = 0
+        self.communities = {}
+        for k,(comm,count) in enumerate(izip(arrays["commIds"].tolist(),arrays["eCounts"].tolist())):
+            self.communities[comm] = community(dict(izip(eCols[start:start+count],eValues[start:start+count])),eii[k])
+            start += count
+        self.aValues = array('d',arrays["aValues"].tolist())
+        self.parent = array('l',arrays["parent"].tolist())
+        self.nextMember = array('l',arrays["nextMember"].tolist())
+        self.lastMember = array('l',arrays["lastMember"].tolist())
+
+        #the heaps only ever hand out live values, so rebuilding them from the live values gives the same joins
+        deltaQCols = arrays["deltaQCols"].tolist()
+        deltaQValues = arrays["deltaQValues"].tolist()
+        start = 0
+        self.deltaQs = {}
+        self.rowHeaps = {}
+        self.maxHeap = []
+        for comm,count in izip(arrays["deltaQRows"].tolist(),arrays["deltaQCounts"].tolist()):
+            cols = deltaQCols[start:start+count]
+            values = deltaQValues[start:start+count]
+            start += count
+            self.deltaQs[comm] = dict(izip(cols,values))
+            heap = sorted(izip([-deltaQ for deltaQ in values],cols)) #sorted is a valid heap
+            self.rowHeaps[comm] = heap
+            if heap:
+                self.maxHeap.append((heap[0][0],comm,heap[0][1]))
+        heapq.heapify(self.maxHeap)
+        self.comparableCommunities = set(arrays["comparable"].tolist())
+
+        self.mergeLog = merge_log()
+        self.mergeLog.i.extend(arrays["mergeI"].tolist())
+        self.mergeLog.j.extend(arrays["mergeJ"].tolist())
+        self.mergeLog.deltaQ.extend(arrays["mergeDeltaQ"].tolist())
+        self.QPath = arrays["QPath"].tolist()
+        self.currQValue = float(arrays["currQValue"])
+        self.maxQValue = float(arrays["maxQValue"])
+        self.maxQStep = int(arrays["maxQStep"])
+        self.stopAtNegativeDeltaQ = bool(arrays["stopAtNegativeDeltaQ"])
+        self.resolution = float(arrays["resolution"])
+        self.isDone = bool(arrays["isDone"])
+        self._currCommunityData = None
+        self._currMembership = None
+        self.maxQValueCommData = None
+
+    def summarize(self,method,start,nMerges,nClusters):
+        '''ends the findCommunities phase started at start and gathers the run_summary'''
+        summary = run_summary(method)
+        summary.seconds = self.endPhase("findCommunities",start)
+        summary.phases = dict(self.timings)
+        if self.counters is not None:
+            summary.counters = dict(self.counters)
+        summary.nMerges = nMerges
+        summary.maxQValue = self.maxQValue
+        summary.nClusters = nClusters
+        return summary
+
+    def findCommunitiesMultilevel(self,maxLevels=None,maxSweeps=50,tolerance=1e-7):
+        '''alternates local node moves with collapsing communities into single nodes (see multilevel)'''
+        '''fills maxQValueCommData, membership and QPath (Q after every level) just like the greedy joins'''
+        '''returns a run_summary'''
+        start = time.time()
+        offsets, cols, eValues, a = self.singletonArrays()
+        nodeLabels, QPath, coarse = multilevelPartition(offsets,cols,eValues,a,maxLevels=maxLevels,maxSweeps=maxSweeps,tolerance=tolerance,resolution=self.resolution)
+        self.endPhase("multilevelPartition",start)
+        self.QPath.extend(QPath)
+        if QPath:
+            self.currQValue = QPath[-1]
+            self.currCommunityData = self.communityDataFromLabels(nodeLabels,coarse)
+            if self.currQValue > self.maxQValue:
+                self.maxQValue = self.currQValue
+                self.maxQValueCommData = self.currCommunityData
+        self.isDone = True
+        if self.verbose:
+            self.printDone()
+        return self.summarize("multilevel",start,len(QPath),len(self.currCommunityData) if QPath else self.nNodes)
+
+    def findCommunitiesByComponent(self,method="greedy",stopAtFirstNegativeDeltaQ=True,processes=None,minParallelNodes=1000):
+        '''clusters every connected component on its own, the big ones in parallel over a process pool'''
+        '''components smaller than minParallelNodes are handed to the workers in batches of about that many nodes'''
+        '''every component keeps the global normalization, so its Q adds up to the global Q and it stops at its own best Q'''
+        '''returns a run_summary'''
+        start = time.time()
+        nComponents, componentLabels = self.graph.connectedComponents()
+        order = np.argsort(componentLabels,kind='mergesort')
+        sizes = np.bincount(componentLabels,minlength=nComponents)
+        bounds = np.zeros(nComponents+1,dtype=np.int64)
+        np.cumsum(sizes,out=bounds[1:])
+        bounds = bounds.tolist()
+
+        #biggest components first, the small ones packed together
+        tasks = []
+        batch = []
+        batchNodes = 0
+        for comp in np.argsort(-sizes,kind='mergesort').tolist():
+            nodeIds = order[bounds[comp]:bounds[comp+1]]
+            if len(nodeIds) == 1:
+                continue #nothing to join, it stays on its own
+            if len(nodeIds) >= minParallelNodes:
+                tasks.append([nodeIds])
+            else:
+                batch.append(nodeIds)
+                batchNodes += len(nodeIds)
+                if batchNodes >= minParallelNodes:
+                    tasks.append(batch)
+                    batch = []
+                    batchNodes = 0
+        if batch:
+            tasks.append(batch)
+        if self.verbose:
+            print "Clustering", nComponents, "components in", len(tasks), "tasks"
+
+        work = []
+        for k,task in enumerate(tasks):
+            pieces = []
+            for nodeIds in task:
+                sub = self.graph.subgraph(nodeIds)
+                pieces.append((sub.names,sub.offsets,sub.neighbors,sub.weights))
+            work.append((k,pieces,self.totalEdges,method,stopAtFirstNegativeDeltaQ,self.resolution))
+
+        poolStart = time.time()
+        if processes == 1 or len(work) <= 1:
+            results = map(clusterComponents,work)
+        else:
+            pool = Pool(processes)
+            try:
+                results = list(pool.imap_unordered(clusterComponents,work))
+            finally:
+                pool.close()
+                pool.join()
+        self.endPhase("clusterComponents",poolStart)
+
+        #stitch the per component labels together, single node components get their own label
+        nodeLabels = np.empty(self.nNodes,dtype=np.int64)
+        nodeLabels[:] = self.nNodes + np.arange(self.nNodes)
+        nextLabel = 0
+        for k,componentResults in sorted(results,key=itemgetter(0)):
+            for nodeIds,(localLabels,localQ) in izip(tasks[k],componentResults):
+                nodeLabels[nodeIds] = nextLabel + localLabels
+                nextLabel += int(localLabels.max()) + 1
+
+        coarse, labels = self.collapseLabels(nodeLabels)
+        self.currCommunityData = self.communityDataFromLabels(labels,coarse)
+        self.currQValue = coarseQ(coarse,self.resolution)
+        self.QPath.append(self.currQValue)
+        self.maxQValue = self.currQValue
+        self.maxQValueCommData = self.currCommunityData
+        self.isDone = True
+        if self.verbose:
+            self.printDone()
+        return self.summarize("byComponent",start,nComponents,len(self.currCommunityData))
+
+    def resolutionSweep(self,resolutions,method="greedy",stopAtFirstNegativeDeltaQ=True,processes=None):
+        '''clusters the loaded graph once for every resolution (gamma) in resolutions, in parallel over a process pool'''
+        '''the graph arrays are put in shared memory once and every worker works on them read-only, nothing is re-read or copied'''
+        '''returns one row per resolution, in the order given, see clusterAtResolution'''
+        graph = self.graph
+        shared = []
+        for values,ctype in ((graph.offsets,ctypes.c_int64),(graph.neighbors,ctypes.c_int64),(graph.weights,ctypes.c_double)):
+            raw = RawArray(ctype,len(values))
+            np.ctypeslib.as_array(raw)[:] = values
+            shared.append(raw)
+        initargs = (graph.nNodes,shared[0],shared[1],shared[2],self.totalEdges)
+        work = [(resolution,method,stopAtFirstNegativeDeltaQ) for resolution in resolutions]
+
+        start = time.time()
+        if processes == 1 or len(work) <= 1:
+            initResolutionWorker(*initargs)
+            table = map(clusterAtResolution,work)
+        else:
+            pool = Pool(processes,initializer=initResolutionWorker,initargs=initargs)
+            try:
+                table = pool.map(clusterAtResolution,work)
+            finally:
+                pool.close()
+                pool.join()
+        self.endPhase("resolutionSweep",start)
+        if self.verbose:
+            print "%10s %10s %10s %10s %10s" % ("resolution","Q","modularity","clusters","largest")
+            for row in table:
+                print "%10g %10.5f %10.5f %10d %10d" % (row["resolution"],row["Q"],row["modularity"],row["nClusters"],row["largest"])
+        return table
+
+    def updateEdges(self,changed=(),removed=(),maxSweeps=50):
+        '''takes a batch of edge changes on an already clustered graph and re-optimizes only the communities they touch'''
+        '''changed: (node1, node2, weight) for new edges, new nodes or new weights.  removed: (node1, node2) pairs'''
+        '''starts from the current membership, so the work follows the size of the batch, not of the graph'''
+        '''returns the number of nodes moved, the new Q is appended to QPath'''
+        if self.incremental is None:
+            membership = self.membership
+            self.incremental = incremental_state(self.graph,[membership[node] for node in self.nodes],self.totalEdges,resolution=self.resolution)
+        state = self.incremental
+
+        touched = []
+        for n1,n2,weight in changed:
+            u = state.nodeId(n1)
+            v = state.nodeId(n2)
+            state.setWeight(u,v,float(weight))
+            touched.extend((u,v))
+        for n1,n2 in removed:
+            u = self._graph.ids[n1]
+            v = self._graph.ids[n2]
+            state.setWeight(u,v,0.0)
+            touched.extend((u,v))
+
+        nMoves = state.reoptimize(touched,maxSweeps=maxSweeps)
+        self.totalEdges = state.totalEdges
+        self.nNodes = len(self.nodes)
+        self.currQValue = state.Q()
+        self.QPath.append(self.currQValue)
+        self.maxQValue = self.currQValue
+        self.maxQValueCommData = None
+        self.isDone = True
+        if self.verbose:
+            print "Updated", len(touched)//2, "edges,", nMoves, "moves, Q is now", self.currQValue
+        return nMoves
+
+    def collapseLabels(self,nodeLabels):
+        '''the loaded graph with every community of a node -> community labelling collapsed into one node (see multilevel.aggregate)'''
+        '''returns the coarse (offsets, cols, eValues, selfE, a) and the node -> coarse node map'''
+        offsets, cols, eValues, a = self.singletonArrays()
+        return aggregate(offsets,cols,eValues,np.zeros(self.nNodes),a,nodeLabels)
+
+    def communityDataForLabels(self,nodeLabels,commIds=None):
+        '''community data (members, e, a) for any node -> community labelling of the loaded graph'''
+        coarse, labels = self.collapseLabels(nodeLabels)
+        return self.communityDataFromLabels(labels,coarse,commIds)
+
+    def communityDataFromLabels(self,nodeLabels,coarse,commIds=None):
+        '''community data (members, e, a) for a node -> community labelling and its collapsed (offsets, cols, eValues, selfE, a) graph'''
+        '''the communities are keyed 0..k-1 in coarse node order, or on commIds[k] if given'''
+        offsets, cols, eValues, selfE, a = [x.tolist() for x in coarse]
+        if commIds is None:
+            commIds = range(len(a))
+        order = np.argsort(nodeLabels,kind='mergesort').tolist()
+        sizes = np.bincount(nodeLabels,minlength=len(a)).tolist()
+        commData = {}
+        start = 0
+        for k,comm in enumerate(commIds):
+            e = defaultdict(float,izip([commIds[c] for c in cols[offsets[k]:offsets[k+1]]],eValues[offsets[k]:offsets[k+1]]))
+            e[comm] = selfE[k]
+            commData[comm] = {"members":[self.nodes[node] for node in order[start:start+sizes[k]]],"e":e,"a":a[k]}
+            start += sizes[k]
+        return commData
 
     def joinNextPair(self,i,j):
         '''this routine joins two community clusters i and j'''
@@ -236,148 +892,233 @@ class modularity_cluster(object):
         if i > j:
             print "I SHOULD NEVER BE BIGGER THAN J!"
 
-        for member in self.currCommunityData[j]["members"]:
-            self.updateCurrMembership(member,i) #HERE: Check this
-        
-        self.currCommunityData[i]["members"].extend(self.currCommunityData[j]["members"])
+        #j hangs under i in the union-find, its member list goes on the end of the one of i
+        self.parent[j] = i
+        self.nextMember[self.lastMember[i]] = j
+        self.lastMember[i] = self.lastMember[j]
+        self._currCommunityData = None
+        self._currMembership = None
 
-        #combine values of eii
-        self.currCommunityData[i]["e"][i]+=self.currCommunityData[j]["e"][j] + self.currCommunityData[j]["e"][i] + self.currCommunityData[i]["e"][j]
-
-        #fix values of eik for curr comm, combine values of eij for other comm, fix values of a
-        self.currCommunityData[i]["a"]+=self.currCommunityData[j]["a"]
+        neighbours = self.joinRows(i,j)
+        communities = self.communities
+        aValues = self.aValues
+        twoGamma = 2*self.resolution
 
         keysToUpdate = set()
-        for comm in self.comparableCommunities: #HERE: Is a good place for imporovemnt.  When we combine memberships maybe we only need to do it for nonzero values?
-
-            if comm != i and comm !=j:
-                if self.currCommunityData[i]["e"].has_key(comm) or self.currCommunityData[j]["e"].has_key(comm) or self.currCommunityData[comm]["e"].has_key(j) or self.currCommunityData[comm]["e"].has_key(i):
-                    if comm < i:
-                        keysToUpdate.add((comm,i))
-                    else:
-                        keysToUpdate.add((i,comm))
-                    self.currCommunityData[comm]["e"][i]+=self.currCommunityData[comm]["e"][j]
-                    self.currCommunityData[i]["e"][comm]+=self.currCommunityData[j]["e"][comm]
-                    #remove all refs to j
-                    del self.currCommunityData[comm]["e"][j]
-                    if comm in self.deltaQs and j in self.deltaQs[comm]:
-                        del self.deltaQs[comm][j]
-
-        if (i,j) in keysToUpdate:
-            keysToUpdate.remove((i,j))
-
-        #remove cluster j
-        del self.currCommunityData[i]["e"][j]
-        del self.currCommunityData[j]
+        rowsTouched = set([i])
+        nDeleted = 2 #row j, and row i or its entry for j
+        for comm in neighbours:
+            if comm < i:
+                keysToUpdate.add((comm,i))
+            else:
+                keysToUpdate.add((i,comm))
+            if comm in self.deltaQs and j in self.deltaQs[comm]:
+                del self.deltaQs[comm][j]
+                rowsTouched.add(comm)
+                nDeleted += 1
+
         self.comparableCommunities.remove(j)
-        print "cluster",j,"has been merged with cluster", i
 
-        removeIFlag = False
-        if len(self.currCommunityData[i]["e"]) == 1:
+        del self.deltaQs[j]
+        del self.rowHeaps[j]
+
+        if not communities[i].e:
+            #nothing left to join with i, no other row can reference it either
             if i in self.comparableCommunities:
-                removeIFlag =True
                 self.comparableCommunities.remove(i)
-                print "removing from comparison cluster", i
-
-        if not removeIFlag:
-            for (c1,c2) in keysToUpdate:
-                if c1 < c2:
-                    self.deltaQs[c1][c2] = self.currCommunityData[c2]["e"][c1] + self.currCommunityData[c1]["e"][c2]-2*self.currCommunityData[c1]["a"]*self.currCommunityData[c2]["a"]
-                elif c2 < c1:
-                    print "c2 should never be smaller than c1 once you get here!!", c1, c2
-                    self.deltaQs[c2][c1] = self.currCommunityData[c2]["e"][c1] + self.currCommunityData[c1]["e"][c2]-2*self.currCommunityData[c1]["a"]*self.currCommunityData[c2]["a"]
-            del self.deltaQs[j]
-            del self.deltaQs[i][j]
-        else:
-            del self.deltaQs[j]
             del self.deltaQs[i]
+            del self.rowHeaps[i]
+            rowsTouched.remove(i)
+        else:
+            del self.deltaQs[i][j]
+            for (c1,c2) in keysToUpdate:
+                self.setDeltaQ(c1,c2,communities[c2].e[c1] + communities[c1].e[c2]-twoGamma*aValues[c1]*aValues[c2])
+                rowsTouched.add(c1)
+
+        for comm in rowsTouched:
+            self.pushRowMax(comm)
+
+        if self.counters is not None:
+            counters = self.counters
+            counters["joins"] += 1
+            counters["communityDataUpdates"] += len(neighbours)
+            counters["deltaQDeletes"] += nDeleted
+            if i in self.deltaQs:
+                counters["deltaQSets"] += len(keysToUpdate)
+                counters["rowHeapPushes"] += len(keysToUpdate)
+
+    def joinRows(self,i,j):
+        '''folds the e row and a of community j into i, returns the other communities next to them'''
+        communities = self.communities
+        ci = communities[i]
+        cj = communities.pop(j)
+        ei = ci.e
+        ej = cj.e
 
-            for key1 in self.deltaQs:
-                if i in self.deltaQs[key1]:
-                    del self.deltaQs[key1][i]
-                if j in self.deltaQs[key1]:
-                    del self.deltaQs[key1][j]
+        #combine values of eii
+        ci.eii += cj.eii + ej.pop(i,0.0) + ei.pop(j,0.0)
+        self.aValues[i] += self.aValues[j]
+
+        #e rows are kept symmetric, so the only communities touched by the join are the neighbours of i and j
+        neighbours = set(ei)
+        neighbours.update(ej)
+        for comm,e in ej.iteritems():
+            row = communities[comm].e
+            row[i] = row.get(i,0.0) + row.pop(j)
+            ei[comm] = ei.get(comm,0.0) + e
+        return neighbours
+
+    def setDeltaQ(self,c1,c2,deltaQ):
+        '''sets deltaQ for the pair c1 < c2 and records it on the row heap of c1'''
+        self.deltaQs[c1][c2] = deltaQ
+        heapq.heappush(self.rowHeaps[c1],(-deltaQ,c2))
+
+    def pushRowMax(self,c1):
+        '''drops stale entries off the top of row c1 and offers its current max to the global heap'''
+        row = self.deltaQs[c1]
+        heap = self.rowHeaps[c1]
+        rebuilt = len(heap) > 2*len(row) + 8
+        if rebuilt:
+            #too many stale entries piled up, rebuild from the live values
+            heap = [(-deltaQ,c2) for c2,deltaQ in row.iteritems()]
+            heapq.heapify(heap)
+            self.rowHeaps[c1] = heap
+        nStale = 0
+        while heap and row.get(heap[0][1]) != -heap[0][0]:
+            heapq.heappop(heap)
+            nStale += 1
+        if heap:
+            heapq.heappush(self.maxHeap,(heap[0][0],c1,heap[0][1]))
+        if self.counters is not None:
+            self.counters["rowHeapRebuilds"] += rebuilt
+            self.counters["rowHeapStalePops"] += nStale
+            self.counters["maxHeapPushes"] += bool(heap)
 
     def findNextPair(self):
-        '''goes through the data and finds the next pair to join that maximizes deltaQ'''
-        if len(self.currCommunityData)==1 or len(self.comparableCommunities)==0:
-            #only one community, nothing to do here.
-            return
-
-        maxs = {}
-        for key1 in self.deltaQs:
-            if len(self.deltaQs[key1]) > 0:
-                keyMax, valMax = max(self.deltaQs[key1].items(), key=lambda x: x[1])
-                maxs[(key1,keyMax)] = valMax
-
-
-        if len(maxs.items()) == 0:
-            print self.comparableCommunities
-            print "maxItems:", maxs.items()
-            self.printClustersJSON(outputFile="something_wrong_comm.json")
-            return
-
-        (key1,key2),deltaQ = max(maxs.items(), key=lambda x: x[1])
-        currMax = deltaQ
-        return deltaQ, (key1,key2)
+        '''pops the global heap until it finds the live pair that maximizes deltaQ'''
+        '''ties are broken towards the smallest (i,j)'''
+        while self.maxHeap:
+            negDeltaQ, key1, key2 = self.maxHeap[0]
+            if key1 in self.deltaQs and self.deltaQs[key1].get(key2) == -negDeltaQ:
+                return -negDeltaQ, (key1,key2)
+            heapq.heappop(self.maxHeap)
+            if self.counters is not None:
+                self.counters["maxHeapStalePops"] += 1
+        #no candidate pairs left
+        return None
+
+    def findNextPairs(self,threshold):
+        '''pops the live row maxima with deltaQ >= threshold (and > 0) off the global heap, best first'''
+        '''keeps the pairs that share no community with a better one, the others go back on the heap'''
+        pairs = []
+        used = set()
+        blocked = []
+        maxHeap = self.maxHeap
+        while maxHeap and -maxHeap[0][0] >= threshold and maxHeap[0][0] < 0:
+            entry = heapq.heappop(maxHeap)
+            negDeltaQ, key1, key2 = entry
+            if key1 not in self.deltaQs or self.deltaQs[key1].get(key2) != -negDeltaQ:
+                if self.counters is not None:
+                    self.counters["maxHeapStalePops"] += 1
+                continue
+            if key1 in used or key2 in used:
+                blocked.append(entry)
+                continue
+            used.add(key1)
+            used.add(key2)
+            pairs.append((-negDeltaQ,(key1,key2)))
+        for entry in blocked:
+            heapq.heappush(maxHeap,entry)
+        return pairs
         
     def setUpCommunity(self):
         '''initialize every node to be it's own community island and empty out all values'''
-        '''then call computeEs on these island'''
-
-        #Do stuff with es here!
-        for i,node in enumerate(self.nodes):
-            self.currCommunityData[i]={}
-            self.currCommunityData[i]["members"]=[]
-            self.currCommunityData[i]["members"].append(node)
-            self.currMembership[node]=i
-            self.currCommunityData[i]["e"] = defaultdict(float)
-            self.currCommunityData[i]["e"][i] =0
-            self.currCommunityData[i]["a"] = 0
-            self.comparableCommunities.add(i)
-        
+        '''then call setUpEs on these island'''
+        offsets, cols, eValues, a = self.singletonArrays()
+        offsets = offsets.tolist()
+        cols = cols.tolist()
+        eValues = eValues.tolist()
+        self.communities = dict((c1,community(dict(izip(cols[offsets[c1]:offsets[c1+1]],eValues[offsets[c1]:offsets[c1+1]]))))
+                                for c1 in xrange(self.nNodes))
+        self.aValues = array('d',a.tolist())
+        self.parent = array('l',xrange(self.nNodes))
+        self.nextMember = array('l',[-1])*self.nNodes
+        self.lastMember = array('l',xrange(self.nNodes))
+        self._currCommunityData = None
+        self._currMembership = None
+        self.comparableCommunities = set(xrange(self.nNodes))
+
         self.setUpEs()
         self.setUpQ()
 
+    def singletonArrays(self):
+        '''e and a of the single node communities as flat arrays, straight from the graph in O(E)'''
+        '''returns offsets, neighbours, e values (CSR over the edges that are not self loops) and a'''
+        graph = self.graph
+        rowIds = np.repeat(np.arange(graph.nNodes),np.diff(graph.offsets))
+        notSelf = graph.neighbors != rowIds #should never add weight of self with self
+        rowIds = rowIds[notSelf]
+        cols = graph.neighbors[notSelf]
+        eValues = graph.weights[notSelf]/self.totalEdges*0.5
+        a = np.bincount(rowIds,weights=eValues,minlength=graph.nNodes)
+        offsets = np.zeros(graph.nNodes+1,dtype=np.int64)
+        np.cumsum(np.bincount(rowIds,minlength=graph.nNodes),out=offsets[1:])
+        return offsets, cols, eValues, a
+
     def computeQ(self):
         #computes value of Q
         self.currQValue = 0
-        for c1 in self.currCommunityData:
-            self.currQValue+=(self.currCommunityData[c1]["e"][c1]-self.currCommunityData[c1]["a"]**2)
+        for c1 in sorted(self.communities):
+            self.currQValue+=(self.communities[c1].eii-self.resolution*self.aValues[c1]**2)
 
     def setUpQ(self):
         '''for first pass, compute Q'''
-        for c1 in self.currCommunityData:
-            self.currQValue+=(self.currCommunityData[c1]["e"][c1]-self.currCommunityData[c1]["a"]**2)
+        for c1 in xrange(self.nNodes):
+            self.currQValue+=(self.communities[c1].eii-self.resolution*self.aValues[c1]**2)
         self.maxQValue= self.currQValue
-        self.maxQValueCommData = dcopy(self.currCommunityData)
+        self.maxQStep = 0
+        self.maxQValueCommData = None
         #self.pp.pprint(self.maxQValueCommData)
 
     def setUpEs(self):
-        '''loops over all edges to set up nNodes number of single component communities to initialize algorithm'''
-        for c1 in self.currCommunityData:
-            for c2 in self.currCommunityData:
-                if c1 != c2:
-                    #self.currCommunityData[c1]["e"][c2] = 0
-                    for m1 in self.currCommunityData[c1]["members"]:
-                        for m2 in self.currCommunityData[c2]["members"]:
-                            if m1 == m2: #CAREFUL SHOULD ONLY HAPPEN IF COMM=COMM2!!
-                                #do nothing, should never add weight of self with self
-                                print "something has gone horribly wrong, something is a member of two communities at once!"
-                                print "c1: ", c1, "c2:", c2, "member: ", m1
-                            elif (m1,m2) in self.edgeData:
-                                self.currCommunityData[c1]["e"][c2]+=self.edgeData[(m1,m2)]*0.5
-                                self.currCommunityData[c1]["a"]+=self.currCommunityData[c1]["e"][c2]
-
-        for c1 in self.currCommunityData:
-            self.deltaQs.setdefault(c1,{})
-            for c2 in self.currCommunityData[c1]["e"].keys():
-                if c1 < c2:
-                    currDeltaQ = self.currCommunityData[c2]["e"][c1] + self.currCommunityData[c1]["e"][c2]-2*self.currCommunityData[c1]["a"]*self.currCommunityData[c2]["a"]
-                    if currDeltaQ > 0:
-                        self.deltaQs[c1][c2]=currDeltaQ
+        '''sets up the deltaQs of the single node communities, with their row heaps and the global heap, in batch'''
+        offsets, cols, eValues, a = self.singletonArrays()
+        rowIds = np.repeat(np.arange(self.nNodes),np.diff(offsets))
+
+        #deltaQ_ij = e_ji + e_ij - 2 gamma a_i a_j for every i < j next to each other, only the positive ones to start
+        upper = rowIds < cols
+        rowIds = rowIds[upper]
+        cols = cols[upper]
+        eValues = eValues[upper]
+        deltaQ = (eValues + eValues) - 2*self.resolution*a[rowIds]*a[cols]
+        positive = deltaQ > 0
+        rowIds = rowIds[positive]
+        cols = cols[positive]
+        negDeltaQ = -deltaQ[positive]
+
+        #sorted by (row, -deltaQ, j), so every row slice already is a valid heap
+        order = np.lexsort((cols,negDeltaQ,rowIds))
+        rowIds = rowIds[order]
+        cols = cols[order]
+        negDeltaQ = negDeltaQ[order]
+        rowOffsets = np.zeros(self.nNodes+1,dtype=np.int64)
+        np.cumsum(np.bincount(rowIds,minlength=self.nNodes),out=rowOffsets[1:])
+
+        starts = rowOffsets[:-1][np.diff(rowOffsets) > 0]
+        self.maxHeap = zip(negDeltaQ[starts].tolist(),rowIds[starts].tolist(),cols[starts].tolist())
+        heapq.heapify(self.maxHeap)
+
+        rowOffsets = rowOffsets.tolist()
+        cols = cols.tolist()
+        negDeltaQ = negDeltaQ.tolist()
+        deltaQ = (-np.asarray(negDeltaQ)).tolist()
+        self.deltaQs = {}
+        self.rowHeaps = {}
+        for c1 in xrange(self.nNodes):
+            start, end = rowOffsets[c1], rowOffsets[c1+1]
+            self.deltaQs[c1] = dict(izip(cols[start:end],deltaQ[start:end]))
+            self.rowHeaps[c1] = zip(negDeltaQ[start:end],cols[start:end])
 
-        
         #if you want to see all went well
         #self.pp.pprint(self.currCommunityData)
 
@@ -393,8 +1134,11 @@ class modularity_cluster(object):
         oF.close()
         return
 
-    def printgnu(self,filename="gnuOut.dat"):
-        '''nice routine to print for use for gnuplot''' 
+    def printgnu(self,filename="gnuOut.dat",sparse=False,chunkRows=100000):
+        '''nice routine to print for use for gnuplot'''
+        '''sparse=True only writes the pairs with an edge (in cluster order, chunkRows rows at a time) instead of all N^2 of them'''
+        if sparse:
+            return self.printgnuSparse(filename,chunkRows=chunkRows)
         oF = open(filename,"w")
         members = []
         for comm in self.maxQValueCommData:
@@ -402,29 +1146,311 @@ class modularity_cluster(object):
         oF.write("#Plotting Commands: set pm3d map; plot \"gnuOut.dat\" u 3:4:5 w image\n")
         oF.write("#Node1 Node2 OrderIndex1 OrderIndex2 OriginalWeight\n")
 
+        ids = self.graph.ids
         for i,m1 in enumerate(members):
+            cols, vals = self.graph.row(ids[m1])
+            rowWeights = dict(izip(cols.tolist(),vals.tolist()))
             for j,m2 in enumerate(members):
-                if self.originalData.has_key((m1,m2)):
-                    toPrint = m1 + " " + m2 + " " + str(i) + " " + str(j) + " " + str(self.originalData[(m1,m2)]) + "\n"
-                else:
-                    toPrint = m1 + " " + m2 + " " + str(i) + " " + str(j) + " " + str(0.0) + "\n"
-               
+                toPrint = m1 + " " + m2 + " " + str(i) + " " + str(j) + " " + str(rowWeights.get(ids[m2],0.0)) + "\n"
                 oF.write(toPrint)
             oF.write("\n")
         oF.close()
 
+    def printgnuSparse(self,filename="gnuSparse.dat",chunkRows=100000):
+        '''the nonzero lines of printgnu only (same columns and order indices), row by row in cluster order'''
+        commIds, labels, order = self.clusterLabels()
+        graph = self.graph
+        position = np.empty(self.nNodes,dtype=np.int64)
+        position.fill(-1)
+        position[order] = np.arange(len(order))
+        names = self.nodes
+
+        oF = open(filename,"w")
+        oF.write("#Plotting Commands: unset key; plot \"%s\" u 3:4:5 w points pt 5 ps 0.5 palette\n" % filename)
+        oF.write("#Node1 Node2 OrderIndex1 OrderIndex2 OriginalWeight\n")
+        for start in xrange(0,len(order),chunkRows):
+            rows = order[start:start+chunkRows]
+            slots, counts = graph.rowSlots(rows)
+            rowIds = np.repeat(rows,counts)
+            cols = graph.neighbors[slots]
+            vals = graph.weights[slots]
+            keep = position[cols] >= 0 #members of removed clusters are left out, like printgnu does
+            rowIds = rowIds[keep]
+            cols = cols[keep]
+            vals = vals[keep]
+            sortKey = np.lexsort((position[cols],position[rowIds]))
+            rowIds = rowIds[sortKey].tolist()
+            cols = cols[sortKey].tolist()
+            vals = vals[sortKey].tolist()
+            oF.write("".join([names[u] + " " + names[v] + " " + str(pu) + " " + str(pv) + " " + str(w) + "\n"
+                              for u,v,pu,pv,w in izip(rowIds,cols,position[rowIds].tolist(),position[cols].tolist(),vals)]))
+        oF.close()
+
+    def printgnuBlocks(self,filename="gnuBlocks.dat",chunkLines=1000000):
+        '''cluster by cluster matrix of the max Q break up, only the nonzero cells'''
+        '''the weight between two clusters is summed over both directions of every edge (so the diagonal holds twice the internal weight), e is that over 2*totalEdges'''
+        commIds, labels, order = self.clusterLabels()
+        nClusters = len(commIds)
+        offsets, cols, eValues, selfE, a = self.clusterArrays(labels,nClusters)
+        rowIds = np.repeat(np.arange(len(a)),np.diff(offsets))
+        #the diagonal goes in with the rest, then everything in (row, col) order
+        rowIds = np.concatenate((rowIds,np.arange(len(a))))
+        cols = np.concatenate((cols,np.arange(len(a))))
+        eValues = np.concatenate((eValues,selfE))
+        keep = (rowIds < nClusters) & (cols < nClusters) & (eValues != 0)
+        rowIds = rowIds[keep]
+        cols = cols[keep]
+        eValues = eValues[keep]
+        sortKey = np.lexsort((cols,rowIds))
+        rowIds = rowIds[sortKey]
+        cols = cols[sortKey]
+        eValues = eValues[sortKey]
+
+        oF = open(filename,"w")
+        oF.write("#Plotting Commands: unset key; plot \"%s\" u 1:2:5 w points pt 5 palette\n" % filename)
+        oF.write("#ClusterIndex1 ClusterIndex2 Cluster1 Cluster2 Weight e\n")
+        for start in xrange(0,len(rowIds),chunkLines):
+            c1s = rowIds[start:start+chunkLines].tolist()
+            c2s = cols[start:start+chunkLines].tolist()
+            es = eValues[start:start+chunkLines].tolist()
+            oF.write("".join([str(c1) + " " + str(c2) + " " + str(commIds[c1]) + " " + str(commIds[c2]) + " " + str(e*2*self.totalEdges) + " " + str(e) + "\n"
+                              for c1,c2,e in izip(c1s,c2s,es)]))
+        oF.close()
+
+    def saveNpz(self,filename="communities.npz"):
+        '''compact binary (numpy .npz) copy of the max Q break up:'''
+        '''nodes (names, by node id), cluster (cluster index of every node, -1 if its cluster was removed), communities (community ids),'''
+        '''size, a and eInternal (e_CC) of every cluster, and Q'''
+        commIds, labels, order = self.clusterLabels()
+        nClusters = len(commIds)
+        coarse = self.clusterArrays(labels,nClusters)
+        np.savez_compressed(filename,
+                            nodes=np.array(self.nodes),
+                            cluster=labels.astype(np.int32),
+                            communities=np.array(commIds,dtype=np.int64),
+                            size=np.bincount(labels[labels >= 0],minlength=nClusters),
+                            a=coarse[4][:nClusters],
+                            eInternal=coarse[3][:nClusters],
+                            Q=np.float64(self.maxQValue))
+
+    def saveModel(self,filename="communities.model"):
+        '''writes the max Q membership as a read-only, memory mappable model file for serving lookups (see cluster_model)'''
+        commIds, labels, order = self.clusterLabels()
+        clusters = np.where(labels >= 0,np.array(commIds+[-1],dtype=np.int64)[labels],-1)
+        saveModel(filename,self.nodes,clusters,Q=self.maxQValue)
+
+    def clusterLabels(self):
+        '''the max Q break up as arrays: community ids (in maxQValueCommData order), the cluster index of every node id (-1 if not in any) and the node ids in cluster order'''
+        ids = self.graph.ids
+        commIds = []
+        order = []
+        for comm in self.maxQValueCommData:
+            commIds.append(comm)
+            order.extend([ids[member] for member in self.maxQValueCommData[comm]["members"]])
+        order = np.array(order,dtype=np.int64)
+        sizes = [len(self.maxQValueCommData[comm]["members"]) for comm in commIds]
+        labels = np.empty(self.nNodes,dtype=np.int64)
+        labels.fill(-1)
+        labels[order] = np.repeat(np.arange(len(commIds)),sizes)
+        return commIds, labels, order
+
+    def clusterArrays(self,labels,nClusters):
+        '''e and a collapsed onto the nClusters clusters of labels (see clusterLabels and multilevel.aggregate)'''
+        '''nodes outside every cluster (label -1) end up in one extra cluster at the end'''
+        coarse, coarseMap = self.collapseLabels(np.where(labels < 0,nClusters,labels))
+        return coarse
+
 #END Classes
 #================================
 
+#================================
+#Functions
+def rootsOf(parent):
+    '''follows a union-find parent array (parents never bigger than their children) to the root of every node'''
+    parent = np.array(parent,dtype=np.int64)
+    while True:
+        grandParent = parent[parent]
+        if (grandParent == parent).all():
+            return parent
+        parent = grandParent
+
+def clusterComponents(work):
+    '''process pool worker for findCommunitiesByComponent: clusters every graph piece of one task on its own'''
+    '''returns the task number and, per piece, the community (0..k-1) of every node and its share of Q'''
+    k, pieces, totalEdges, method, stopAtFirstNegativeDeltaQ, resolution = work
+    results = []
+    for names, offsets, neighbors, weights in pieces:
+        mc = modularity_cluster(verbose=False,resolution=resolution)
+        mc.setUpGraph(csr_graph(names,offsets,neighbors,weights),totalEdges=totalEdges)
+        mc.findCommunities(stopAtFirstNegativeDeltaQ=stopAtFirstNegativeDeltaQ,method=method)
+        commIds, labels, order = mc.clusterLabels()
+        results.append((labels,mc.maxQValue))
+    return k, results
+
+_sweepGraph = None #(csr_graph, totalEdges) of a resolutionSweep worker
+
+def initResolutionWorker(nNodes,offsets,neighbors,weights,totalEdges):
+    '''process pool initializer for resolutionSweep: views the shared graph arrays as a csr_graph, without copying them'''
+    global _sweepGraph
+    graph = csr_graph(xrange(nNodes),np.ctypeslib.as_array(offsets),np.ctypeslib.as_array(neighbors),np.ctypeslib.as_array(weights))
+    _sweepGraph = (graph,totalEdges)
+
+def clusterAtResolution(work):
+    '''process pool worker for resolutionSweep: clusters the shared graph at one resolution'''
+    '''returns resolution, Q (at that resolution), modularity (Q of the same break up at resolution 1), nClusters,'''
+    '''and the cluster sizes: largest, median, singletons and sizeHistogram (number of clusters of size 2^k up to 2^(k+1)-1)'''
+    resolution, method, stopAtFirstNegativeDeltaQ = work
+    graph, totalEdges = _sweepGraph
+    start = time.time()
+    mc = modularity_cluster(verbose=False,resolution=resolution)
+    mc.setUpGraph(graph,totalEdges=totalEdges)
+    mc.findCommunities(stopAtFirstNegativeDeltaQ=stopAtFirstNegativeDeltaQ,method=method)
+
+    commIds, labels, order = mc.clusterLabels()
+    sizes = np.bincount(labels)
+    return {"resolution":resolution,
+            "Q":mc.maxQValue,
+            "modularity":coarseQ(mc.clusterArrays(labels,len(commIds))),
+            "nClusters":len(sizes),
+            "largest":int(sizes.max()) if len(sizes) else 0,
+            "median":float(np.median(sizes)) if len(sizes) else 0.0,
+            "singletons":int((sizes == 1).sum()),
+            "sizeHistogram":np.bincount(np.log2(sizes).astype(np.int64)).tolist() if len(sizes) else [],
+            "seconds":time.time()-start}
+
+OUTPUTS = {"json":".json","mr":".MR","npz":".npz","model":".model","gnu":".tsv"}
+
+def inputFiles(inputs):
+    '''the edge files named by inputs: files, directories (every *.csv in them) and glob patterns, sorted and without repeats'''
+    files = set()
+    for name in inputs:
+        if os.path.isdir(name):
+            files.update(glob.glob(os.path.join(name,"*.csv")))
+        elif os.path.isfile(name):
+            files.add(name)
+        else:
+            files.update(path for path in glob.glob(name) if os.path.isfile(path))
+    return sorted(files)
+
+def fileHash(fn,settings,chunkBytes=1<<20):
+    '''sha1 of the contents of fn and of the settings it is clustered with'''
+    digest = hashlib.sha1(json.dumps(settings,sort_keys=True))
+    inFile = open(fn,'rb')
+    try:
+        while True:
+            chunk = inFile.read(chunkBytes)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        inFile.close()
+    return digest.hexdigest()
+
+def clusterFile(work):
+    '''process pool worker of main: clusters one edge file and writes its outputs next to root, unless root.hash says they are up to date'''
+    '''returns (fn, status, message), status is "done", "cached" or "failed"'''
+    fn, root, settings = work
+    start = time.time()
+    try:
+        key = fileHash(fn,settings)
+        stampFN = root + ".hash"
+        if os.path.exists(stampFN) and all(os.path.exists(root + OUTPUTS[output]) for output in settings["outputs"]):
+            stampFile = open(stampFN)
+            cached = stampFile.read().strip() == key
+            stampFile.close()
+            if cached:
+                return fn, "cached", ""
+
+        mc = modularity_cluster(verbose=False,resolution=settings["resolution"])
+        mc.loadEdges(fn,ignoreHeader=settings["ignoreHeader"])
+        mc.findCommunities(stopAtFirstNegativeDeltaQ=settings["stopAtFirstNegativeDeltaQ"],method=settings["method"],refine=settings["refine"])
+        for output in settings["outputs"]:
+            outFN = root + OUTPUTS[output]
+            if output == "json":
+                mc.printClustersJSON(outputFile=outFN)
+            elif output == "mr":
+                mc.printMR(outputFile=outFN)
+            elif output == "npz":
+                mc.saveNpz(filename=outFN)
+            elif output == "model":
+                mc.saveModel(filename=outFN)
+            elif output == "gnu":
+                mc.printgnu(filename=outFN,sparse=True)
+        #the stamp goes last, a run that dies half way is redone next time
+        stampFile = open(stampFN,'w')
+        stampFile.write(key + "\n")
+        stampFile.close()
+        return fn, "done", "Q = %.6f, %d clusters, %.2f s" % (mc.maxQValue,len(mc.maxQValueCommData),time.time()-start)
+    except (Exception,SystemExit), error:
+        return fn, "failed", "%s: %s" % (type(error).__name__,error)
+
+#END Functions
+#================================
+
 #================================
 #Main
 #================================
 
 def main():
-    #dummy main, don't use
-    numargs = 0 
-    if len(sys.argv) != (numargs+1): 
-        print "please give me",numargs,"argument(s)"
+    parser = argparse.ArgumentParser(description="clusters every edge CSV (node1,node2,weight) given, over a pool of processes")
+    parser.add_argument("inputs",nargs="+",help="edge CSV files, directories (every *.csv in them) or glob patterns")
+    parser.add_argument("-o","--outputDir",default=".",help="where the outputs go, <file name without .csv>.<ext> (default: current directory)")
+    parser.add_argument("-p","--processes",type=int,default=None,help="number of files clustered at once (default: number of CPUs)")
+    parser.add_argument("--method",default="greedy",choices=["greedy","multilevel"])
+    parser.add_argument("--resolution",type=float,default=1.0)
+    parser.add_argument("--stopAtFirstNegativeDeltaQ",action="store_true",help="stop the greedy joins at the first negative deltaQ")
+    parser.add_argument("--refine",action="store_true",help="run refineCommunities on every result")
+    parser.add_argument("--ignoreHeader",action="store_true",help="the CSVs have a header line")
+    parser.add_argument("--outputs",default="json,mr,npz",help="comma separated, out of "+",".join(sorted(OUTPUTS)))
+    parser.add_argument("--force",action="store_true",help="recluster even if the cached result is up to date")
+    args = parser.parse_args()
+
+    outputs = args.outputs.split(",")
+    for output in outputs:
+        if output not in OUTPUTS:
+            print "unknown output", output, "please use some of", ",".join(sorted(OUTPUTS))
+            sys.exit(1)
+    files = inputFiles(args.inputs)
+    if not files:
+        print "no edge files found in", " ".join(args.inputs)
+        sys.exit(1)
+
+    roots = {}
+    for fn in files:
+        root = os.path.join(args.outputDir,os.path.splitext(os.path.basename(fn))[0])
+        if root in roots:
+            print "both", roots[root], "and", fn, "would write to", root, "please split them up"
+            sys.exit(1)
+        roots[root] = fn
+    if not os.path.isdir(args.outputDir):
+        os.makedirs(args.outputDir)
+    if args.force:
+        for root in roots:
+            if os.path.exists(root + ".hash"):
+                os.remove(root + ".hash")
+
+    settings = {"method":args.method,"resolution":args.resolution,"stopAtFirstNegativeDeltaQ":args.stopAtFirstNegativeDeltaQ,
+                "refine":args.refine,"ignoreHeader":args.ignoreHeader,"outputs":outputs}
+    work = [(fn,root,settings) for root,fn in sorted(roots.iteritems(),key=itemgetter(1))]
+    if args.processes == 1 or len(work) == 1:
+        results = imap(clusterFile,work)
+        pool = None
+    else:
+        pool = Pool(args.processes)
+        results = pool.imap_unordered(clusterFile,work)
+
+    counts = defaultdict(int)
+    try:
+        for fn, status, message in results:
+            counts[status] += 1
+            print status, fn, message
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print "%d files: %d clustered, %d cached, %d failed" % (len(work),counts["done"],counts["cached"],counts["failed"])
+    if counts["failed"]:
         sys.exit(1)
 
 
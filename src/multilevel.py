@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------
+File Information:
+
+@file = multilevel.py
+@author: Yael Elmatad
+@email: yael.elmatad@tapad.com
+@date: <date>
+-------------------------------------------------
+Copyright Information:
+
+-------------------------------------------------
+Some general description of what this script/module does:
+
+Multilevel (Louvain style, Blondel et al. J. Stat. Mech. P10008 (2008)) modularity
+clustering, the alternative to the pair by pair joins of modularity_cluster.
+
+Every level sweeps over the nodes moving each one to the neighbouring community that
+gains the most Q, until a sweep moves nothing, then collapses every community into a
+single node of a coarser graph and starts over.  It stops once a level moves nothing.
+
+It works on the same quantities as modularity_cluster: e_ij (half the edge weight over
+the total weight, i != j) kept as CSR arrays, the internal e_ii of every (coarse) node
+and a_i.  Moving node i from community D to C changes Q by
+    2*(e_iC - gamma*a_i*a_C) - 2*(e_iD - gamma*a_i*a_D)    (D without i)
+where gamma is the resolution (1 for plain modularity, bigger gives smaller communities).
+
+"""
+#================================
+#Imports
+import numpy as np
+
+#================================
+#Functions
+def moveNodes(offsets,cols,eValues,a,maxSweeps=50,tolerance=1e-7,resolution=1.0,labels=None):
+    '''local moving phase: returns the community label of every node and whether anything moved'''
+    '''a sweep only revisits nodes with a neighbour that moved since they were last looked at'''
+    '''sweeps stop once a sweep moves nothing or gains less than tolerance in Q'''
+    '''starts from every node on its own, or from labels (0..nNodes-1) if given'''
+    nNodes = len(a)
+    if labels is None:
+        labels = range(nNodes)
+        aTot = a.tolist()                       #a of every community
+    else:
+        aTot = np.bincount(labels,weights=a,minlength=nNodes).tolist()
+        labels = list(labels)
+    offsets = offsets.tolist()
+    cols = cols.tolist()
+    eValues = eValues.tolist()
+    a = a.tolist()
+    active = [offsets[i] != offsets[i+1] for i in xrange(nNodes)]
+
+    anyMoves = False
+    for sweep in xrange(maxSweeps):
+        nMoves = 0
+        gained = 0.0
+        for i in xrange(nNodes):
+            if not active[i]:
+                continue
+            active[i] = False
+            start, end = offsets[i], offsets[i+1]
+            current = labels[i]
+            ai = a[i]
+            weightTo = {}
+            for k in xrange(start,end):
+                c = labels[cols[k]]
+                weightTo[c] = weightTo.get(c,0.0) + eValues[k]
+
+            #take i out, then put it back where it gains the most (ties stay put, then go to the smaller label)
+            aTot[current] -= ai
+            best = current
+            stayGain = weightTo.get(current,0.0) - resolution*ai*aTot[current]
+            bestGain = stayGain
+            for c, w in weightTo.iteritems():
+                gain = w - resolution*ai*aTot[c]
+                if gain > bestGain or (gain == bestGain and best != current and c < best):
+                    best = c
+                    bestGain = gain
+            aTot[best] += ai
+            if best != current:
+                labels[i] = best
+                nMoves += 1
+                gained += 2*(bestGain - stayGain)
+                for k in xrange(start,end):
+                    if labels[cols[k]] != best:
+                        active[cols[k]] = True
+        if nMoves == 0:
+            break
+        anyMoves = True
+        if gained < tolerance:
+            break
+    return labels, anyMoves
+
+def aggregate(offsets,cols,eValues,selfE,a,labels):
+    '''collapses every community into one node, returns the coarse (offsets, cols, eValues, selfE, a) and the node -> coarse node map'''
+    nNodes = len(a)
+    uniqueLabels, coarse = np.unique(np.asarray(labels,dtype=np.int64),return_inverse=True)
+    nCoarse = len(uniqueLabels)
+
+    rowIds = np.repeat(np.arange(nNodes),np.diff(offsets))
+    coarseRows = coarse[rowIds]
+    coarseCols = coarse[cols]
+    internal = coarseRows == coarseCols
+
+    #e inside a community ends up on the diagonal, both directions of the edge, like joinNextPair does it
+    newSelfE = np.bincount(coarse,weights=selfE,minlength=nCoarse) + np.bincount(coarseRows[internal],weights=eValues[internal],minlength=nCoarse)
+    newA = np.bincount(coarse,weights=a,minlength=nCoarse)
+
+    keys = coarseRows[~internal]*nCoarse + coarseCols[~internal]
+    uniqueKeys, inverse = np.unique(keys,return_inverse=True)
+    newEValues = np.bincount(inverse,weights=eValues[~internal],minlength=len(uniqueKeys))
+    newRows = uniqueKeys // nCoarse
+    newCols = uniqueKeys % nCoarse
+    newOffsets = np.zeros(nCoarse+1,dtype=np.int64)
+    np.cumsum(np.bincount(newRows,minlength=nCoarse),out=newOffsets[1:])
+    return (newOffsets,newCols,newEValues,newSelfE,newA), coarse
+
+def coarseQ(graph,resolution=1.0):
+    '''Q of the break up a collapsed (offsets, cols, eValues, selfE, a) graph stands for: sum_C e_CC - gamma*a_C^2'''
+    return float(graph[3].sum() - resolution*(graph[4]**2).sum())
+
+def multilevelPartition(offsets,cols,eValues,a,maxLevels=None,maxSweeps=50,tolerance=1e-7,resolution=1.0):
+    '''runs the levels on the single node e/a arrays (see modularity_cluster.singletonArrays)'''
+    '''returns the community of every original node, the Q after every level and the final coarse graph'''
+    nNodes = len(a)
+    graph = (offsets,cols,eValues,np.zeros(nNodes),a)
+    nodeLabels = np.arange(nNodes)
+    QPath = []
+    level = 0
+    while maxLevels is None or level < maxLevels:
+        labels, moved = moveNodes(graph[0],graph[1],graph[2],graph[4],maxSweeps=maxSweeps,tolerance=tolerance,resolution=resolution)
+        if not moved:
+            break
+        graph, coarse = aggregate(graph[0],graph[1],graph[2],graph[3],graph[4],labels)
+        nodeLabels = coarse[nodeLabels]
+        QPath.append(coarseQ(graph,resolution))
+        level += 1
+    return nodeLabels, QPath, graph
+
+#END Functions
+#================================